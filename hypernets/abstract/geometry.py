@@ -101,7 +101,7 @@ class Geometry(object):
 
         return block_position
 
-    def get_absolute_pan_tilt(self, now=None, quiet=False):
+    def get_absolute_pan_tilt(self, now=None, quiet=False, location=None):
         try:  # FIXME
             from configparser import ConfigParser
             config_file = "config_dynamic.ini"
@@ -114,7 +114,7 @@ class Geometry(object):
         except KeyError as key:
             warning(f" {key} default values loaded")
             # Default values :
-            # offset_tilt = 0
+            offset_tilt = 0
             offset_pan = 0
             azimuth_switch = 360
 
@@ -130,11 +130,15 @@ class Geometry(object):
         # Get sun position
         if 'sun' in [pan_ref, tilt_ref]:  # pickle me :
             from hypernets.geometry.spa_hypernets import spa_from_datetime
-            azimuth_sun, zenith_sun = spa_from_datetime(now=now, quiet=quiet)
+            azimuth_sun, zenith_sun = spa_from_datetime(now=now, quiet=quiet,
+                                                        location=location)
             zenith_sun = 180 - zenith_sun
 
             # determine hemisphere
-            latitude = float(config["GPS"]["latitude"])
+            if location is not None:
+                latitude = location[0]
+            else:
+                latitude = float(config["GPS"]["latitude"])
             if latitude >= 0:
                 hemisphere_offset = 0
                 hemisphere_conv = pos
@@ -0,0 +1,125 @@
+"""
+Decoder of the names given to the files of a sequence.
+
+Geometry.create_block_position_name and Request.spectra_name_convention
+write names such as :
+
+    01_015_0090_2_0180                        (block position)
+    01_015_0090_2_0180.jpg                    (picture)
+    01_015_0090_2_0180_128_16_0064_03_0000.spe (spectra)
+
+i.e. scheduler iteration, line, pan, reference, tilt, then radiometer mask,
+entrance mask, integration time, number of captures and total measurement
+time. decode_names() turns any number of names into a structured array :
+
+    table = decode_names(listdir("SEQ20210609T093031/RADIOMETER"))
+    table[(table["entrance"] == ENTRANCES["rad"]) & (table["tilt"] == 40)]
+"""
+
+from warnings import catch_warnings, simplefilter
+
+import numpy as np
+
+
+BLOCK_FIELDS = ("iter_scheduler", "line", "pan", "reference", "tilt")
+SPECTRA_FIELDS = ("radiometer", "entrance", "it", "count", "total_time")
+
+# Masks of Request.spectra_name_convention, the radiometer and entrance bits
+# are also the ones of the spec_type of the records (RADIOMETER_MASK)
+RADIOMETERS = {"vnir": 0x80, "swir": 0x40, "both": 0xC0}
+ENTRANCES = {"dark": 0x00, "irr": 0x08, "rad": 0x10, "pic": 0x02, "vm": 0x04}
+
+RADIOMETER_MASK = 0xC0
+
+# Radiometers of the records and their names in the calibration coefficients
+# (config.dump)
+CC_RADIOMETERS = {"vnir": "VIS", "swir": "SWIR"}
+
+
+def names_dtype(width=48):
+    return np.dtype([("name", f'U{width}'), ("valid", '?')] +
+                    [(field, '<i4') for field in BLOCK_FIELDS] +
+                    [(field, '<i4') for field in SPECTRA_FIELDS])
+
+
+def is_decodable(stem):
+    try:
+        [int(token) for token in stem.split("_")]
+    except ValueError:
+        return False
+    return True
+
+
+def parse_fields(stems):
+    """
+    Integers of the '_' separated fields of the stems, in a row. Parsing
+    stops at the first field that isn't an integer.
+    """
+    text = " ".join(stems.tolist()).replace("_", " ")
+    try:
+        with catch_warnings():
+            simplefilter("ignore", DeprecationWarning)
+            return np.fromstring(text, dtype=np.int64, sep=" ")
+    except ValueError:  # numpy >= 2.3
+        return np.empty(0, dtype=np.int64)
+
+
+def decode_names(names):
+    """
+    Structured array (names_dtype) of the fields of block position, picture
+    and spectra names (with or without directory).
+
+    Names that don't follow the convention have valid=False, fields that a
+    name doesn't have (spectra fields of a block position) are -1. Pictures
+    have the radiometer 0x00 and the entrance 0x02.
+    """
+    names = np.asarray(names, dtype=str).reshape(-1)
+    if len(names) == 0:
+        return np.empty(0, dtype=names_dtype())
+
+    basenames = names
+    if (np.char.find(names, "/") >= 0).any():
+        basenames = np.char.rpartition(names, "/")[:, 2]
+
+    parts = np.char.rpartition(basenames, ".")
+    has_extension = parts[:, 1] == "."
+    stems = np.where(has_extension, parts[:, 0], parts[:, 2])
+    extensions = np.where(has_extension, parts[:, 2], "")
+
+    nb_fields = np.char.count(stems, "_") + 1
+    valid = ((nb_fields == 10) & (extensions == "spe")) | \
+        ((nb_fields == 5) & np.isin(extensions, ["jpg", ""]))
+
+    # Only digits, '-' and '_' (0 is the padding of the array)
+    codes = stems.view(np.uint32).reshape(len(stems), -1)
+    valid &= (((codes >= ord("0")) & (codes <= ord("9"))) | (codes == 0) |
+              (codes == ord("-")) | (codes == ord("_"))).all(axis=1)
+
+    table = np.empty(len(names), dtype=names_dtype(max(names.itemsize // 4,
+                                                       1)))
+    table["name"] = names
+    for field in BLOCK_FIELDS + SPECTRA_FIELDS:
+        table[field] = -1
+
+    # All the fields of all the valid names are parsed in one go
+    values = parse_fields(stems[valid])
+    if len(values) != nb_fields[valid].sum():
+        valid[valid] = [is_decodable(stem) for stem in stems[valid]]
+        values = parse_fields(stems[valid])
+
+    table["valid"] = valid
+    rows = np.flatnonzero(valid)
+    starts = np.cumsum(nb_fields[rows]) - nb_fields[rows]
+
+    for k, field in enumerate(BLOCK_FIELDS):
+        table[field][rows] = values[starts + k]
+
+    spectra = nb_fields[rows] == 10
+    for k, field in enumerate(SPECTRA_FIELDS, start=len(BLOCK_FIELDS)):
+        table[field][rows[spectra]] = values[starts[spectra] + k]
+
+    pictures = rows[extensions[rows] == "jpg"]
+    table["radiometer"][pictures] = 0x00
+    table["entrance"][pictures] = ENTRANCES["pic"]
+
+    return table
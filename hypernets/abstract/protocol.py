@@ -4,9 +4,92 @@ from operator import le, ge, lt, gt
 
 from hypernets.abstract.geometry import Geometry
 from hypernets.abstract.request import Request, InstrumentAction
-from hypernets.hypstar.libhypstar.python.data_structs.spectrum_raw import RadiometerType  # noqa
+from hypernets.geometry.path_planning import plan_path
+from hypernets.hypstar.libhypstar.python.data_structs.spectrum_raw import RadiometerType, RadiometerEntranceType  # noqa
 
-from logging import debug, info  # noqa
+from logging import debug, info, warning  # noqa
+
+
+# Markers of the blocks of geometries that can be reordered :
+#   ~ #reorderable
+#   @[...] ...
+#   ~ #ordered
+REORDERABLE, ORDERED = "#reorderable", "#ordered"
+
+# Rough durations of Protocol.timeline()
+# Typical integration times (ms) found by the instrument when IT is 0
+TYPICAL_IT = {(RadiometerType.VIS_NIR, RadiometerEntranceType.IRRADIANCE): 64,
+              (RadiometerType.VIS_NIR, RadiometerEntranceType.RADIANCE): 512,
+              (RadiometerType.SWIR, RadiometerEntranceType.IRRADIANCE): 256,
+              (RadiometerType.SWIR, RadiometerEntranceType.RADIANCE): 2048}
+AUTO_IT_CAPTURES = 3     # test captures of the automatic integration time
+SCAN_OVERHEAD = 0.1      # s, readout and download of a scan
+REQUEST_OVERHEAD = 1.0   # s, environment log and capture setup
+PICTURE_TIME = 5.0       # s, capture and download of a 5 MP picture
+VALIDATION_TIME = 2.0    # s, validation module switched on and off
+SETTLE_TIME = 2.0        # s, position polled until the pan-tilt is stable
+STARTUP_TIME = 30.0      # s, instrument boot, meteo, metadata
+SWIR_STARTUP_TIME = 60.0 # s, SWIR thermal regulation
+
+# open_sequence aborts when the Yocto power-off is closer than this (s)
+WATCHDOG_MARGIN = 120
+
+
+def move_time(position_0, position_1):
+    """
+    Estimated time (s) of a pan-tilt move between absolute positions
+    (10^-2 degrees), settling included.
+    """
+    from hypernets.geometry.pan_tilt import pt_time_estimation
+
+    slew = pt_time_estimation(position_0, position_1)
+    if slew > 0:
+        slew += SETTLE_TIME
+    return slew
+
+
+def request_duration(request, last_it):
+    """
+    Estimated duration (s) of a request. 'last_it' holds the last
+    integration time of each radiometer (reused by darks with IT 0) and is
+    updated.
+    """
+    if request.action == InstrumentAction.PICTURE:
+        return request.number_cap * PICTURE_TIME
+
+    if request.action not in (InstrumentAction.MEASUREMENT,
+                              InstrumentAction.VALIDATION):
+        return 0.
+
+    duration = REQUEST_OVERHEAD
+    if request.action == InstrumentAction.VALIDATION:
+        duration += VALIDATION_TIME
+
+    radiometers = {RadiometerType.VIS_NIR: [RadiometerType.VIS_NIR],
+                   RadiometerType.SWIR: [RadiometerType.SWIR],
+                   RadiometerType.BOTH: [RadiometerType.VIS_NIR,
+                                         RadiometerType.SWIR]}
+    its = {RadiometerType.VIS_NIR: request.it_vnir,
+           RadiometerType.SWIR: request.it_swir}
+
+    # VNIR and SWIR counted one after the other (upper bound)
+    for radiometer in radiometers.get(request.radiometer, []):
+        it = its[radiometer]
+        if it == 0 and request.entrance == RadiometerEntranceType.DARK:
+            it = last_it[radiometer]
+        elif it == 0:
+            it = TYPICAL_IT.get((radiometer, request.entrance), 0)
+            duration += AUTO_IT_CAPTURES * it / 1000
+
+        if request.entrance != RadiometerEntranceType.DARK:
+            last_it[radiometer] = it
+
+        if request.number_cap == 0:
+            duration += request.total_measurement_time / 1000
+        else:
+            duration += request.number_cap * (it / 1000 + SCAN_OVERHEAD)
+
+    return duration
 
 
 class Protocol(list[(Geometry, list[Request])]):
@@ -14,6 +97,7 @@ class Protocol(list[(Geometry, list[Request])]):
         self.name = filename
         self.version = None
         self.flags = dict()
+        self.reorderable = list()
 
         if self.name is not None:
             with open(filename, 'r') as fd:
@@ -67,12 +151,25 @@ class Protocol(list[(Geometry, list[Request])]):
         def split_flag(line):
             return [e for e in split(r"~|:=", line) if e]
 
+        segment_start = None
+
         def parse_chunk(line):
+            nonlocal segment_start
+
             # New flag Definition
             if not len(line):
                 return
             if line[0] == "~":
-                self.add_flag(*split_flag(line))
+                flag = split_flag(line)
+                if flag == [REORDERABLE] and segment_start is None:
+                    segment_start = len(self)
+                elif flag == [ORDERED] and segment_start is not None:
+                    self.reorderable.append((segment_start, len(self)))
+                    segment_start = None
+                elif len(flag) == 1:
+                    warning(f"Unexpected marker : {line}")
+                else:
+                    self.add_flag(*flag)
 
             # New Geometry
             elif line[0] == "@":
@@ -120,6 +217,9 @@ class Protocol(list[(Geometry, list[Request])]):
                     debug(f"line {line}")
                     parse_chunk(line)
 
+        if segment_start is not None:
+            self.reorderable.append((segment_start, len(self)))
+
     def check_if_instrument_requested(self):
         for _, request_list in self:
             for request in request_list:
@@ -150,6 +250,120 @@ class Protocol(list[(Geometry, list[Request])]):
         return False
 
 
+    @staticmethod
+    def park_position(now=None, location=None):
+        """ Absolute pan-tilt of the park position (nadir, 10^-2 degrees). """
+        park = Geometry(Geometry.reference_to_int("hyper", "hyper"))
+        park.get_absolute_pan_tilt(now=now, quiet=True, location=location)
+        return round(park.pan_abs * 100), round(park.tilt_abs * 100)
+
+    def timeline(self, now=None, location=None):
+        """
+        Absolute pan-tilt (10^-2 degrees), move and capture times (s) of the
+        geometries of a sequence starting at 'now' (UTC) at 'location'
+        (latitude, longitude, default from config_dynamic.ini), as rows of
+        (position, slew, capture), and total duration (start-up included).
+
+        The pan-tilt starts from park, moves include the settling time and the
+        sun positions are taken when each geometry is reached. Geometries with
+        flags are counted as if they were run.
+        """
+        from datetime import datetime, timedelta, timezone
+
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        elapsed = STARTUP_TIME
+        if self.check_if_swir_requested():
+            elapsed += SWIR_STARTUP_TIME
+
+        rows = []
+        position = self.park_position(now, location)
+        last_it = {RadiometerType.VIS_NIR: 0, RadiometerType.SWIR: 0}
+        for geometry, requests in self:
+            geometry.get_absolute_pan_tilt(
+                now=now + timedelta(seconds=elapsed), quiet=True,
+                location=location)
+            target = (round(geometry.pan_abs * 100),
+                      round(geometry.tilt_abs * 100))
+
+            slew = move_time(position, target)
+            capture = sum(request_duration(request, last_it)
+                          for request in requests)
+
+            rows.append((target, slew, capture))
+            position = target
+            elapsed += slew + capture
+
+        return rows, elapsed
+
+    def slew_time(self, now=None, location=None):
+        """ Estimated time (s) of the pan-tilt moves, see timeline(). """
+        rows, _ = self.timeline(now, location)
+        return sum(slew for _, slew, _ in rows)
+
+    def reorder_geometries(self, now=None, location=None):
+        """
+        Reorders the geometries of the reorderable blocks to minimise the
+        estimated pan-tilt time, from the geometry before a block (or park)
+        to the one after it. Blocks with flags, or whose spectra files
+        ($spectra_fileN) are used by flags, are kept in order. Returns the
+        estimated times of the moves before and after (s), see timeline().
+        """
+        rows, _ = self.timeline(now, location)
+        positions = [position for position, _, _ in rows]
+        park = self.park_position(now, location)
+        time_before = sum(slew for _, slew, _ in rows)
+
+        # Lines (request numbers) of the spectra files used by flags
+        flag_lines = {int(line) for variable, _, _ in self.flags.values()
+                      for line in re.findall(r"\$spectra_file(\d+)",
+                                             variable)}
+
+        for start, stop in self.reorderable:
+            if any(geometry.flags for geometry, _ in self[start:stop]):
+                warning(f"Geometries {start + 1}-{stop} have flags, they "
+                        f"are kept in order.")
+                continue
+
+            first_line = 1 + sum(len(requests) for _, requests in self[:start])
+            nb_lines = sum(len(requests) for _, requests in self[start:stop])
+            used = sorted(flag_lines & set(range(first_line,
+                                                 first_line + nb_lines)))
+            if used:
+                warning(f"Geometries {start + 1}-{stop} : flags use "
+                        f"{', '.join(f'$spectra_file{n}' for n in used)}, "
+                        f"they are kept in order.")
+                continue
+
+            # positions at the time they are reached in the protocol order
+            block = positions[start:stop]
+            previous = park if start == 0 else positions[start - 1]
+            costs = [[move_time(p0, p1) for p1 in block] for p0 in block]
+            start_costs = [move_time(previous, p) for p in block]
+            end_costs = None if stop == len(self) else \
+                [move_time(p, positions[stop]) for p in block]
+
+            order = plan_path(costs, start_costs, end_costs)
+            self[start:stop] = [self[start + n] for n in order]
+            positions[start:stop] = [block[n] for n in order]
+
+        time_after = self.slew_time(now, location)
+        info(f"Estimated pan-tilt time : {time_before:.0f} s, "
+             f"{time_after:.0f} s after reordering.")
+        return time_before, time_after
+
+    def estimate_duration(self, now=None, location=None):
+        """
+        Estimated slew and capture times (s) of each geometry, as rows of
+        (geometry, pan_abs, tilt_abs, slew, capture), and total duration of
+        the sequence, see timeline().
+        """
+        rows, total = self.timeline(now, location)
+        return [(geometry, geometry.pan_abs, geometry.tilt_abs, slew,
+                 capture) for (geometry, _), (_, slew, capture)
+                in zip(self, rows)], total
+
     @staticmethod
     def create_seq_name(now, prefix="SEQ", fmt="%Y%m%dT%H%M%S", suffix=""):
         return now.strftime(prefix + fmt + suffix)
@@ -157,17 +371,72 @@ class Protocol(list[(Geometry, list[Request])]):
 
 if __name__ == '__main__':
     from argparse import ArgumentParser
+    from datetime import datetime, timezone
     parser = ArgumentParser()
     parser.add_argument("-f", "--filename", type=str, required=True,
                         help="Select a protocol file (txt, csv)")
 
-    from logging import basicConfig, DEBUG
+    parser.add_argument("-r", "--reorder", action="store_true",
+                        help="Plan the order of the reorderable geometries")
+
+    parser.add_argument("-e", "--estimate", action="store_true",
+                        help="Estimate the duration of the sequence")
+
+    parser.add_argument("-s", "--start", type=str, default=None,
+                        help="Start of the sequence (ISO, UTC, default : now)")
+
+    parser.add_argument("-l", "--location", type=float, nargs=2,
+                        default=None, metavar=("LATITUDE", "LONGITUDE"),
+                        help="Site (default : config_dynamic.ini)")
+
+    parser.add_argument("-w", "--window", type=float, default=None,
+                        help="Time (s) until the Yocto power-off, to check "
+                             "against the duration and watchdog margin")
+
+    args = parser.parse_args()
+
+    from logging import basicConfig, DEBUG, INFO
     log_fmt = '[%(levelname)-7s %(asctime)s] (%(module)s) %(message)s'
     dt_fmt = '%H:%M:%S'
-    basicConfig(level=DEBUG, format=log_fmt, datefmt=dt_fmt)
+    basicConfig(level=INFO if args.estimate else DEBUG, format=log_fmt,
+                datefmt=dt_fmt)
+
+    now = datetime.now(timezone.utc)
+    if args.start is not None:
+        now = datetime.fromisoformat(args.start.rstrip("Z"))\
+            .replace(tzinfo=timezone.utc)
 
-    args = parser.parse_args()
     protocol = Protocol(args.filename)
     protocol.check_if_instrument_requested()
     protocol.check_if_swir_requested()
-    info(protocol)
+
+    if args.reorder:
+        protocol.reorder_geometries(now, args.location)
+
+    if not args.estimate:
+        info(protocol)
+        exit(0)
+
+    rows, total = protocol.estimate_duration(now, args.location)
+    info("Line  pan (abs)  tilt (abs)  slew (s)  capture (s)  end (s)")
+    end = total - sum(slew + capture for *_, slew, capture in rows)
+    for i, (geometry, pan, tilt, slew, capture) in enumerate(rows, start=1):
+        end += slew + capture
+        flags = f"  {geometry.flags}" if geometry.flags else ""
+        info(f"{i:4d}  {pan:9.2f}  {tilt:10.2f}  {slew:8.1f}  {capture:11.1f}"
+             f"  {end:7.0f}{flags}")
+
+    slew = sum(row[3] for row in rows)
+    info(f"Total : {total:.0f} s ({total / 60:.1f} min), {slew:.0f} s of "
+         f"pan-tilt moves, start-up included.")
+
+    if args.window is None:
+        info(f"Needs at least {total + WATCHDOG_MARGIN:.0f} s before the "
+             f"Yocto power-off ({WATCHDOG_MARGIN} s watchdog margin).")
+    elif total + WATCHDOG_MARGIN > args.window:
+        warning(f"Overruns : {total:.0f} s + {WATCHDOG_MARGIN} s watchdog "
+                f"margin > {args.window:.0f} s window.")
+        exit(1)
+    else:
+        info(f"Fits : {total:.0f} s + {WATCHDOG_MARGIN} s watchdog margin "
+             f"<= {args.window:.0f} s window.")
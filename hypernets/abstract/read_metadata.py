@@ -1,38 +1,163 @@
 #!/usr/bin/python3
 
 """
-This is an example to give an idea on how to read a metadata.txt file provided
-in a hypernets data sequence.
+Reader of the metadata.txt file of a hypernets data sequence.
+
+read_metadata() returns the [Metadata] header as a dict and a table
+(numpy structured array) with one row per block position : block name, file
+name, timestamp and the asked, absolute and reported pan-tilt as floats.
+
+    header, table = read_metadata("SEQ20210609T093031/metadata.txt")
+    table[table["tilt_ask"] == 40]["filename"]
+
+The file is parsed line by line (no ConfigParser), read_metadata_files()
+parses many of them into one table.
 """
 
+import numpy as np
+
+from logging import warning
+
+
+PAN_TILT_FIELDS = ("pt_ask", "pt_abs", "pt_ref")
+
+
+def metadata_dtype(block_width=20, filename_width=48):
+    return np.dtype([("block", f'U{block_width}'),
+                     ("filename", f'U{filename_width}'),
+                     ("datetime", 'datetime64[s]'),
+                     ("pan_ask", '<f4'), ("tilt_ask", '<f4'),
+                     ("pan_abs", '<f4'), ("tilt_abs", '<f4'),
+                     ("pan_ref", '<f4'), ("tilt_ref", '<f4')])
+
+
+def parse_datetime(now_str):
+    """ %Y%m%dT%H%M%S string as ISO (NaT if it isn't one). """
+    if len(now_str) != 15 or now_str[8] != "T":
+        return "NaT"
+    return f"{now_str[:4]}-{now_str[4:6]}-{now_str[6:11]}:" \
+        f"{now_str[11:13]}:{now_str[13:15]}"
+
+
+def parse_pan_tilt(value):
+    """ 'pan; tilt' string as two floats (NaN if it can't be read). """
+    pan, _, tilt = value.partition(";")
+    try:
+        return float(pan), float(tilt)
+    except ValueError:
+        return np.nan, np.nan
+
+
+def parse_metadata(lines):
+    """
+    Header dict and rows (block, filename, datetime, pan-tilt values) of the
+    lines of a metadata.txt file.
+    """
+    header = dict()
+    rows = []
+
+    section, files, pan_tilt = None, [], dict()
+
+    def close_section():
+        values = [v for key in PAN_TILT_FIELDS
+                  for v in pan_tilt.get(key, (np.nan, np.nan))]
+        for filename, now_str in files:
+            rows.append((section, filename, parse_datetime(now_str), *values))
+
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+
+        if line[0] == "[" and line[-1] == "]":
+            if section is not None:
+                close_section()
+            section, files, pan_tilt = line[1:-1], [], dict()
+            continue
+
+        key, separator, value = line.partition("=")
+        if not separator:
+            warning(f"Unreadable metadata line : {line}")
+            continue
+        key, value = key.strip(), value.strip()
+
+        if section == "Metadata":
+            header[key] = value
+        elif key in PAN_TILT_FIELDS:
+            pan_tilt[key] = parse_pan_tilt(value)
+        elif section is not None:
+            files.append((key, value))
+
+    if section is not None:
+        close_section()
+
+    return header, rows
+
+
+def make_table(rows):
+    block_width = max([len(row[0]) for row in rows], default=1)
+    filename_width = max([len(row[1]) for row in rows], default=1)
+    return np.array(rows, dtype=metadata_dtype(block_width, filename_width))
+
+
+def read_metadata(filename):
+    """
+    [Metadata] header (dict) and block position table (structured array) of
+    a metadata.txt file.
+    """
+    with open(filename) as fd:
+        header, rows = parse_metadata(fd)
+    return header, make_table(rows)
+
+
+def read_metadata_files(filenames):
+    """
+    Headers of several metadata.txt files and one table of all their block
+    positions, with the index of the file they come from ('sequence').
+    """
+    headers, rows, sequences = [], [], []
+    for n, filename in enumerate(filenames):
+        try:
+            with open(filename) as fd:
+                header, file_rows = parse_metadata(fd)
+        except OSError as e:
+            warning(f"{filename} : {e}")
+            header, file_rows = dict(), []
+
+        headers.append(header)
+        rows += file_rows
+        sequences += len(file_rows) * [n]
+
+    table = make_table(rows)
+    dtype = np.dtype([("sequence", '<i4')] + table.dtype.descr)
+    output = np.empty(len(table), dtype=dtype)
+    output["sequence"] = sequences
+    for field in table.dtype.names:
+        output[field] = table[field]
+
+    return headers, output
+
+
 if __name__ == '__main__':
-    from configparser import ConfigParser
-    # "This module provides the ConfigParser class which implements a basic
-    # configuration language which provides a structure similar to what’s found
-    # in Microsoft Windows INI files."
-    # doc : https://docs.python.org/3/library/configparser.html
-
-    # Create configparser object and open the file
-    metadata = ConfigParser()
-    metadata.read("metadata.txt")
-
-    # Case 1 : I already know a section name and a field ----------------------
-    print("Asked pan-tilt for the image is :")
-    print(metadata["01_015_0090_2_0180"]["pt_ask"])  # type : str
-
-    # Case 2 : I already know a section name ----------------------------------
-    # I make a dict from the parser according to the section name :
-    headerMetadata = dict(metadata["Metadata"])
-    # Then I read the dictionary
-    for field, value in headerMetadata.items():
-        print("%s is %s" % (field, value))
-
-    # Case 3 : I know nothing about the file ----------------------------------
-    # Loop over the section with an iterator
-    for i, section in enumerate(metadata.sections()):
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("-f", "--filename", type=str, default="metadata.txt",
+                        nargs='+', help="metadata.txt file(s)")
+    args = parser.parse_args()
+
+    if isinstance(args.filename, str):
+        args.filename = [args.filename]
+
+    headers, table = read_metadata_files(args.filename)
+
+    for filename, header in zip(args.filename, headers):
         print("="*80)
-        print("Section %i : %s" % (i, section))
+        print(filename)
+        for field, value in header.items():
+            print(f"{field} is {value}")
 
-        # Same as the case 2:
-        for field, value in dict(metadata[section]).items():
-            print("%s is %s" % (field, value))
+    print("="*80)
+    print("\t".join(table.dtype.names))
+    for row in table:
+        print("\t".join(str(value) for value in row))
@@ -0,0 +1,238 @@
+"""
+Parallel processing of the sequences of a DATA/%Y/%m/%d/SEQ... archive.
+
+A task is a function of a sequence directory, run over a date range on a
+pool of processes. Sequences are scheduled by chunks and the state of every
+(task, sequence) job is kept in an SQLite table : an interrupted run goes on
+where it stopped when it is started again.
+
+    python -m hypernets.archive.batch -d DATA -t verify --start 2024-01-01
+    python -m hypernets.archive.batch -d DATA -t mymodule:my_function
+
+Tasks are given by name (TASKS) or as 'module:function', their return value
+is stored as JSON in the job table.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
+from datetime import datetime, timezone
+from glob import glob
+from importlib import import_module
+from json import dumps
+from os import path, cpu_count
+
+import sqlite3
+
+import numpy as np
+
+from hypernets.archive.catalog import list_sequences, sequence_datetime
+from hypernets.archive.export import export_sequence
+from hypernets.reader.spectra import index_spectra
+from hypernets.reader.spectrum import Spectrum
+from hypernets.reader.verify import verify_spectra
+
+from logging import getLogger, info, warning, error, WARNING
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    task TEXT NOT NULL,
+    sequence TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    finished TEXT,
+    PRIMARY KEY (task, sequence)
+);
+"""
+
+
+def spectra_files(seq_path):
+    return sorted(glob(path.join(seq_path, "RADIOMETER", "*.spe")))
+
+
+def verify_sequence(seq_path):
+    """ CRC check of the spectra files of a sequence. """
+    records, bad_crc, skipped = 0, 0, 0
+    for filename in spectra_files(seq_path):
+        with open(filename, 'rb') as fd:
+            offsets, crc_ok, nb_skipped = verify_spectra(fd.read())
+        records += len(offsets)
+        bad_crc += int((~crc_ok).sum())
+        skipped += nb_skipped
+
+    return {"records": records, "bad_crc": bad_crc, "unreadable": skipped}
+
+
+def export_verified_sequence(seq_path):
+    """ CRC check and export to <sequence>.npz. """
+    return {"output": export_sequence(seq_path, verify=True)}
+
+
+def sequence_statistics(seq_path):
+    """
+    Number of spectra, saturated spectra and maximum exposure time per
+    radiometer and entrance.
+    """
+    statistics = dict()
+    for filename in spectra_files(seq_path):
+        with open(filename, 'rb') as fd:
+            buffer = fd.read()
+
+        for offset in index_spectra(buffer):
+            spectrum = Spectrum(buffer, int(offset))
+            key = "_".join(Spectrum.read_spectrum_info(spectrum.spec_type))
+            n, saturated, exposure_time = statistics.get(key, (0, 0, 0))
+            statistics[key] = (n + 1,
+                               saturated + int(np.max(spectrum.counts) >=
+                                               0xFFFF),
+                               max(exposure_time, spectrum.exposure_time))
+
+    return {key: dict(zip(("spectra", "saturated", "max_exposure_time"), v))
+            for key, v in statistics.items()}
+
+
+TASKS = {"verify": verify_sequence,
+         "export": export_verified_sequence,
+         "stats": sequence_statistics}
+
+
+def resolve_task(task):
+    """ Function of a task name or of a 'module:function' string. """
+    if task in TASKS:
+        return TASKS[task]
+    module, _, function = task.partition(":")
+    return getattr(import_module(module), function)
+
+
+def init_worker():
+    # Per-record INFO logs of Spectrum would flood the output
+    getLogger().setLevel(WARNING)
+
+
+def run_chunk(task, sequences):
+    """
+    Run a task on a chunk of sequences (in a worker process). Returns
+    (sequence, status, JSON result or error message) for each one.
+    """
+    function = resolve_task(task)
+    results = []
+    for seq_path in sequences:
+        try:
+            result = dumps(function(seq_path), default=str)
+            results.append((seq_path, "done", result))
+        except Exception as e:
+            results.append((seq_path, "failed", f"{type(e).__name__}: {e}"))
+    return results
+
+
+def select_sequences(data_dir, start=None, end=None):
+    """ Sequences of an archive between two ISO dates (end excluded). """
+    sequences = []
+    for seq_path in list_sequences(data_dir):
+        seq_datetime = sequence_datetime(path.basename(seq_path))
+        if seq_datetime is None:
+            continue
+        if start is not None and seq_datetime < start:
+            continue
+        if end is not None and seq_datetime >= end:
+            continue
+        sequences.append(seq_path)
+    return sequences
+
+
+def run_batch(task, data_dir, jobs="jobs.db", start=None, end=None,
+              workers=None, chunk_size=8, retry_failed=False):
+    """
+    Run 'task' on the sequences of 'data_dir' between 'start' and 'end' that
+    are not done yet. Returns the number of done and failed jobs of this run.
+    """
+    resolve_task(task)  # fail early on an unknown task
+    sequences = select_sequences(data_dir, start, end)
+
+    with closing(sqlite3.connect(jobs)) as connection:
+        connection.executescript(SCHEMA)
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO jobs (task, sequence) VALUES (?, ?)",
+                [(task, seq_path) for seq_path in sequences])
+
+        status = ("pending", "failed") if retry_failed else ("pending", )
+        state = {row[0]: row[1] for row in connection.execute(
+            "SELECT sequence, status FROM jobs WHERE task = ?", (task, ))}
+        todo = [s for s in sequences if state.get(s) in status]
+
+        info(f"{task} : {len(todo)} sequences to process "
+             f"({len(sequences) - len(todo)} already done or failed).")
+
+        chunks = [todo[i:i+chunk_size] for i in range(0, len(todo),
+                                                       chunk_size)]
+        counts = {"done": 0, "failed": 0}
+
+        with ProcessPoolExecutor(max_workers=workers or cpu_count(),
+                                 initializer=init_worker) as pool:
+            futures = [pool.submit(run_chunk, task, chunk) for chunk in chunks]
+
+            for future in as_completed(futures):
+                results = future.result()
+                now = datetime.now(timezone.utc).isoformat()
+                with connection:
+                    connection.executemany(
+                        "UPDATE jobs SET status = ?, result = ?, finished = ? "
+                        "WHERE task = ? AND sequence = ?",
+                        [(status, result, now, task, seq_path)
+                         for seq_path, status, result in results])
+
+                for seq_path, status, result in results:
+                    counts[status] += 1
+                    if status == "failed":
+                        error(f"{seq_path} : {result}")
+
+                info(f"{counts['done'] + counts['failed']}/{len(todo)} "
+                     f"sequences processed.")
+
+    if counts["failed"]:
+        warning(f"{counts['failed']} sequences failed (see --retry-failed).")
+
+    return counts["done"], counts["failed"]
+
+
+if __name__ == '__main__':
+    from logging import basicConfig, INFO
+
+    parser = ArgumentParser()
+    parser.add_argument("-d", "--data-dir", type=str, default="DATA",
+                        help="Archive directory (DATA/%%Y/%%m/%%d/SEQ...)")
+
+    parser.add_argument("-t", "--task", type=str, required=True,
+                        help=f"Task : {', '.join(TASKS)} or module:function")
+
+    parser.add_argument("-j", "--jobs", type=str, default="jobs.db",
+                        help="SQLite job table (resume file)")
+
+    parser.add_argument("--start", type=str, default=None,
+                        help="First date (ISO, included)")
+    parser.add_argument("--end", type=str, default=None,
+                        help="Last date (ISO, excluded)")
+
+    parser.add_argument("-n", "--workers", type=int, default=None,
+                        help="Number of processes (default : number of CPU)")
+
+    parser.add_argument("-c", "--chunk-size", type=int, default=8,
+                        help="Sequences per scheduled chunk")
+
+    parser.add_argument("-r", "--retry-failed", action='store_true',
+                        default=False, help="Run failed jobs again")
+
+    args = parser.parse_args()
+
+    log_fmt = '[%(levelname)-7s %(asctime)s] (%(module)s) %(message)s'
+    basicConfig(level=INFO, format=log_fmt, datefmt='%Y-%m-%dT%H:%M:%S')
+
+    # Workers need run_chunk from the module, not from __main__
+    from hypernets.archive import batch
+
+    _, failed = batch.run_batch(args.task, args.data_dir, args.jobs,
+                                args.start, args.end, args.workers,
+                                args.chunk_size, args.retry_failed)
+    exit(1 if failed else 0)
@@ -0,0 +1,311 @@
+"""
+SQLite catalog of a DATA/%Y/%m/%d/SEQ... archive.
+
+One row per sequence, per block position (with the pan-tilt values of
+metadata.txt) and per file of the RADIOMETER directory (with the fields
+decoded from its name). The archive is scanned incrementally : a sequence is
+only (re)read when its directories changed since the last update.
+
+    python -m hypernets.archive.catalog -d DATA -c catalog.db -u
+    python -m hypernets.archive.catalog -c catalog.db -e rad -t 40 \\
+        --start 2025-05-01 --end 2025-06-01
+"""
+
+from argparse import ArgumentParser
+from contextlib import closing
+from datetime import datetime
+from glob import glob
+from os import path, listdir
+
+import sqlite3
+
+from hypernets.abstract.name_convention import decode_names, BLOCK_FIELDS, \
+    SPECTRA_FIELDS, RADIOMETERS, ENTRANCES
+from hypernets.abstract.read_metadata import read_metadata
+from hypernets.archive.export import read_meteo
+
+from logging import info, debug, warning
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sequences (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    datetime TEXT,
+    mtime REAL NOT NULL,
+    site_name TEXT,
+    hypstar_sn TEXT,
+    protocol TEXT,
+    meteo TEXT
+);
+
+CREATE TABLE IF NOT EXISTS blocks (
+    id INTEGER PRIMARY KEY,
+    sequence_id INTEGER NOT NULL REFERENCES sequences(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    iter_scheduler INTEGER,
+    line INTEGER,
+    pan INTEGER,
+    reference INTEGER,
+    tilt INTEGER,
+    pan_ask REAL, tilt_ask REAL,
+    pan_abs REAL, tilt_abs REAL,
+    pan_ref REAL, tilt_ref REAL
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    sequence_id INTEGER NOT NULL REFERENCES sequences(id) ON DELETE CASCADE,
+    block_id INTEGER REFERENCES blocks(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    datetime TEXT,
+    size INTEGER,
+    iter_scheduler INTEGER,
+    line INTEGER,
+    pan INTEGER,
+    reference INTEGER,
+    tilt INTEGER,
+    radiometer INTEGER,
+    entrance INTEGER,
+    it INTEGER,
+    count INTEGER,
+    total_time INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS sequences_datetime ON sequences(datetime);
+CREATE INDEX IF NOT EXISTS blocks_sequence ON blocks(sequence_id);
+CREATE INDEX IF NOT EXISTS files_sequence ON files(sequence_id);
+CREATE INDEX IF NOT EXISTS files_geometry ON files(entrance, tilt, pan);
+"""
+
+def connect(catalog):
+    connection = sqlite3.connect(catalog)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def name_fields(decoded):
+    """
+    Block position and spectra fields of names from decode_names(), None for
+    the fields that are missing.
+    """
+    for row in decoded:
+        yield tuple(int(row[field]) if row["valid"] else None
+                    for field in BLOCK_FIELDS) + \
+            tuple(int(row[field]) if row["valid"] and row[field] >= 0
+                  else None for field in SPECTRA_FIELDS)
+
+
+def sequence_datetime(name):
+    """ ISO date and time of a sequence from its name (SEQ%Y%m%dT%H%M%S). """
+    try:
+        return datetime.strptime(name[3:18], "%Y%m%dT%H%M%S").isoformat()
+    except ValueError:
+        return
+
+
+def sequence_mtime(seq_path):
+    """ Last change of a sequence (its directory or the RADIOMETER one). """
+    radiometer_path = path.join(seq_path, "RADIOMETER")
+    mtime = path.getmtime(seq_path)
+    if path.isdir(radiometer_path):
+        mtime = max(mtime, path.getmtime(radiometer_path))
+    return mtime
+
+
+def list_sequences(data_dir):
+    """ Finished sequences of an archive (running ones are named CUR...). """
+    pattern = path.join(data_dir, "[0-9]" * 4, "[0-9]" * 2, "[0-9]" * 2,
+                        "SEQ*")
+    return sorted(path.abspath(p) for p in glob(pattern) if path.isdir(p))
+
+
+def insert_sequence(connection, seq_path, mtime):
+    header, metadata = read_metadata(path.join(seq_path, "metadata.txt"))
+    name = path.basename(seq_path)
+
+    sequence_id = connection.execute(
+        "INSERT INTO sequences (path, name, datetime, mtime, site_name, "
+        "hypstar_sn, protocol, meteo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (seq_path, name, sequence_datetime(name), mtime,
+         header.get("site_name"), header.get("hypstar_sn"),
+         header.get("protocol_file_name"), read_meteo(seq_path))).lastrowid
+
+    blocks = dict()
+    for row, values in zip(metadata, name_fields(decode_names(
+            metadata["block"]))):
+        section = str(row["block"])
+        if section in blocks:
+            continue
+        blocks[section] = connection.execute(
+            "INSERT INTO blocks (sequence_id, name, iter_scheduler, line, pan, "
+            "reference, tilt, pan_ask, tilt_ask, pan_abs, tilt_abs, pan_ref, "
+            "tilt_ref) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (sequence_id, section, *values[:len(BLOCK_FIELDS)],
+             *[float(row[field]) for field in metadata.dtype.names[3:]])
+        ).lastrowid
+
+    files_metadata = {str(row["filename"]): (str(row["block"]),
+                                             row["datetime"].item())
+                      for row in metadata}
+
+    radiometer_path = path.join(seq_path, "RADIOMETER")
+    names = sorted(name for name in listdir(radiometer_path)
+                   if name.endswith((".spe", ".jpg"))) \
+        if path.isdir(radiometer_path) else []
+
+    rows = []
+    for filename, values in zip(names, name_fields(decode_names(names))):
+        section, file_datetime = files_metadata.get(filename, (None, None))
+        rows.append((sequence_id, blocks.get(section), filename,
+                     file_datetime and file_datetime.isoformat(),
+                     path.getsize(path.join(radiometer_path, filename)),
+                     *values))
+
+    connection.executemany(
+        "INSERT INTO files (sequence_id, block_id, name, datetime, size, "
+        "iter_scheduler, line, pan, reference, tilt, radiometer, entrance, "
+        "it, count, total_time) VALUES "
+        "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    debug(f"{name} : {len(blocks)} blocks, {len(rows)} files.")
+
+
+def update_catalog(connection, data_dir, prune=True):
+    """
+    Add the new and changed sequences of 'data_dir' to the catalog, and
+    (prune) remove those of 'data_dir' that are gone. Returns the number of
+    sequences read.
+    """
+    known = {row["path"]: row["mtime"] for row in
+             connection.execute("SELECT path, mtime FROM sequences")}
+
+    updated = 0
+    sequences = list_sequences(data_dir)
+    for seq_path in sequences:
+        mtime = sequence_mtime(seq_path)
+        if seq_path in known and known[seq_path] == mtime:
+            continue
+
+        try:
+            with connection:
+                connection.execute("DELETE FROM sequences WHERE path = ?",
+                                   (seq_path, ))
+                insert_sequence(connection, seq_path, mtime)
+            updated += 1
+        except Exception as e:
+            warning(f"Can't catalog {seq_path} : {e}")
+
+    if prune and sequences:
+        root = path.join(path.abspath(data_dir), "")
+        gone = {p for p in known if p.startswith(root)} - set(sequences)
+        with connection:
+            connection.executemany("DELETE FROM sequences WHERE path = ?",
+                                   [(p, ) for p in gone])
+        if gone:
+            info(f"{len(gone)} sequences removed from the catalog.")
+
+    info(f"{updated} sequences added or updated ({len(sequences)} found).")
+    return updated
+
+
+def query_files(connection, start=None, end=None, radiometer=None,
+                entrance=None, pan=None, tilt=None, reference=None,
+                site_name=None, extension=None):
+    """
+    Files matching the given criteria, as rows with the file fields and the
+    full path of the file ('file_path').
+
+    start, end : ISO dates or datetimes (end excluded)
+    radiometer : 'vnir', 'swir' or 'both' (files with this radiometer)
+    entrance : 'rad', 'irr', 'dark', 'pic' or 'vm'
+    pan, tilt : requested values of the block position
+    """
+    where, parameters = [], []
+
+    if start is not None:
+        where.append("sequences.datetime >= ?")
+        parameters.append(start)
+    if end is not None:
+        where.append("sequences.datetime < ?")
+        parameters.append(end)
+    if radiometer is not None:
+        where.append("(files.radiometer & ?) = ?")
+        parameters += 2 * [RADIOMETERS[radiometer]]
+    if entrance is not None:
+        where.append("files.entrance = ?")
+        parameters.append(ENTRANCES[entrance])
+    if pan is not None:
+        where.append("files.pan = ?")
+        parameters.append(pan)
+    if tilt is not None:
+        where.append("files.tilt = ?")
+        parameters.append(tilt)
+    if reference is not None:
+        where.append("files.reference = ?")
+        parameters.append(reference)
+    if site_name is not None:
+        where.append("sequences.site_name = ?")
+        parameters.append(site_name)
+    if extension is not None:
+        where.append("files.name LIKE ?")
+        parameters.append(f"%{extension}")
+
+    query = "SELECT files.*, sequences.path || '/RADIOMETER/' || files.name " \
+        "AS file_path, sequences.name AS sequence FROM files " \
+        "JOIN sequences ON files.sequence_id = sequences.id"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY sequences.datetime, files.line"
+
+    return connection.execute(query, parameters).fetchall()
+
+
+if __name__ == '__main__':
+    from logging import basicConfig, INFO
+
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--catalog", type=str, default="catalog.db",
+                        help="SQLite catalog file")
+
+    parser.add_argument("-d", "--data-dir", type=str, default="DATA",
+                        help="Archive directory (DATA/%%Y/%%m/%%d/SEQ...)")
+
+    parser.add_argument("-u", "--update", action='store_true', default=False,
+                        help="Scan the archive for new sequences")
+
+    parser.add_argument("--start", type=str, default=None,
+                        help="First date (ISO, included)")
+    parser.add_argument("--end", type=str, default=None,
+                        help="Last date (ISO, excluded)")
+    parser.add_argument("-r", "--radiometer", type=str, default=None,
+                        choices=list(RADIOMETERS))
+    parser.add_argument("-e", "--entrance", type=str, default=None,
+                        choices=list(ENTRANCES))
+    parser.add_argument("-p", "--pan", type=int, default=None)
+    parser.add_argument("-t", "--tilt", type=int, default=None)
+    parser.add_argument("-s", "--site", type=str, default=None)
+    parser.add_argument("-x", "--extension", type=str, default=None,
+                        help="File extension (.spe, .jpg)")
+
+    args = parser.parse_args()
+
+    log_fmt = '[%(levelname)-7s %(asctime)s] (%(module)s) %(message)s'
+    basicConfig(level=INFO, format=log_fmt, datefmt='%Y-%m-%dT%H:%M:%S')
+
+    with closing(connect(args.catalog)) as connection:
+        if args.update:
+            update_catalog(connection, args.data_dir)
+
+        criteria = (args.start, args.end, args.radiometer, args.entrance,
+                    args.pan, args.tilt, args.site, args.extension)
+
+        if not args.update or any(c is not None for c in criteria):
+            for row in query_files(connection, args.start, args.end,
+                                   args.radiometer, args.entrance, args.pan,
+                                   args.tilt, site_name=args.site,
+                                   extension=args.extension):
+                print(row["file_path"])
@@ -0,0 +1,276 @@
+"""
+Columnar export of a sequence directory (SEQ...) into a single file.
+
+Counts are stored as one (n_scans x n_pixels) uint16 dataset per radiometer
+with the header fields of every scan and the index of the spectra file it
+comes from. File names, block positions and pan-tilt values come from
+metadata.txt, plus meteo.csv and monitorPD.csv.
+
+Formats : HDF5 (.h5, h5py), NetCDF-4 (.nc, netCDF4) or NumPy (.npz).
+HDF5 and NetCDF datasets are chunked, compressed, and written one spectra
+file at a time.
+"""
+
+from argparse import ArgumentParser
+from glob import glob
+from os import path
+
+import numpy as np
+
+from hypernets.abstract.name_convention import RADIOMETERS, \
+    RADIOMETER_MASK, CC_RADIOMETERS
+from hypernets.abstract.read_metadata import read_metadata
+from hypernets.reader.spectra import index_file, read_counts
+from hypernets.reader.spectrum import HEADER_DTYPE
+
+from logging import info, warning
+
+
+# Scans per chunk of the counts datasets
+CHUNK_SCANS = 64
+
+
+class NpzWriter(object):
+    """ Arrays are kept in memory and saved on close (no chunking). """
+    def __init__(self, filename):
+        self.filename = filename
+        self.arrays = dict()
+
+    def set_attributes(self, attributes):
+        for key, value in attributes.items():
+            self.arrays[f"attrs/{key}"] = np.array(value)
+
+    def create_dataset(self, name, shape, dtype, dims):
+        self.arrays[name] = np.zeros(shape, dtype=dtype)
+        return self.arrays[name]
+
+    def write(self, name, values, dims):
+        self.arrays[name] = np.asarray(values)
+
+    def close(self):
+        np.savez_compressed(self.filename, **self.arrays)
+
+
+class Hdf5Writer(object):
+    def __init__(self, filename):
+        import h5py
+        self.h5py = h5py
+        self.file = h5py.File(filename, 'w')
+
+    def set_attributes(self, attributes):
+        self.file.attrs.update(attributes)
+
+    def create_dataset(self, name, shape, dtype, dims):
+        chunks = (min(shape[0], CHUNK_SCANS), ) + tuple(shape[1:]) \
+            if shape[0] else None
+        return self.file.create_dataset(name, shape=shape, dtype=dtype,
+                                        chunks=chunks, compression="gzip",
+                                        shuffle=True)
+
+    def write(self, name, values, dims):
+        values = np.asarray(values)
+        if values.dtype.kind == 'U':
+            values = values.astype(self.h5py.string_dtype())
+        self.file.create_dataset(name, data=values)
+
+    def close(self):
+        self.file.close()
+
+
+class NetcdfWriter(object):
+    def __init__(self, filename):
+        from netCDF4 import Dataset
+        self.file = Dataset(filename, 'w', format="NETCDF4")
+
+    def set_attributes(self, attributes):
+        self.file.setncatts(attributes)
+
+    def variable(self, name, dtype, shape, dims, **kwargs):
+        *groups, name = name.split("/")
+        group = self.file
+        for group_name in groups:
+            if group_name not in group.groups:
+                group.createGroup(group_name)
+            group = group.groups[group_name]
+
+        for dim, size in zip(dims, shape):
+            if dim not in self.file.dimensions:
+                self.file.createDimension(dim, size)
+
+        return group.createVariable(name, dtype, dims, **kwargs)
+
+    def create_dataset(self, name, shape, dtype, dims):
+        chunks = [min(shape[0], CHUNK_SCANS)] + list(shape[1:]) \
+            if shape[0] else None
+        return self.variable(name, dtype, shape, dims, zlib=True,
+                             shuffle=True, chunksizes=chunks)
+
+    def write(self, name, values, dims):
+        values = np.asarray(values)
+        if values.dtype.kind == 'U':
+            variable = self.variable(name, str, values.shape, dims)
+            variable[:] = values.astype(object)
+        else:
+            variable = self.variable(name, values.dtype, values.shape, dims)
+            variable[:] = values
+
+    def close(self):
+        self.file.close()
+
+
+WRITERS = {".npz": NpzWriter, ".h5": Hdf5Writer, ".hdf5": Hdf5Writer,
+           ".nc": NetcdfWriter}
+
+
+def read_monitor_pd(seq_path):
+    datetimes, lx = [], []
+    try:
+        with open(path.join(seq_path, "monitorPD.csv")) as fd:
+            for line in fd:
+                if line.startswith("#") or not line.strip():
+                    continue
+                now_str, value = line.split("\t")
+                datetimes.append(now_str)
+                lx.append(float(value))
+    except (OSError, ValueError) as e:
+        warning(f"monitorPD.csv : {e}")
+
+    return np.array(datetimes, dtype=str), np.array(lx, dtype=np.float32)
+
+
+def read_meteo(seq_path):
+    try:
+        with open(path.join(seq_path, "meteo.csv")) as fd:
+            return fd.readline().strip()
+    except OSError as e:
+        warning(f"meteo.csv : {e}")
+        return ""
+
+
+def export_sequence(seq_path, output=None, verify=False):
+    """
+    Export a sequence directory into 'output' (default : <seq_path>.npz),
+    the format is given by the extension.
+    """
+    seq_path = path.normpath(seq_path)
+    if output is None:
+        output = seq_path + ".npz"
+
+    extension = path.splitext(output)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError(f"Unknown export format '{extension}' "
+                         f"({', '.join(WRITERS)})")
+
+    header, metadata = read_metadata(path.join(seq_path, "metadata.txt"))
+    spectra_files = sorted(glob(path.join(seq_path, "RADIOMETER", "*.spe")))
+    names = [path.basename(f) for f in spectra_files]
+
+    # First pass : headers only, to size the datasets
+    scans = {radiometer: [] for radiometer in CC_RADIOMETERS}
+    for n, filename in enumerate(spectra_files):
+        _, offsets, headers = index_file(filename, verify)
+        for radiometer in CC_RADIOMETERS:
+            selection = (headers["spec_type"] & RADIOMETER_MASK) == \
+                RADIOMETERS[radiometer]
+            scans[radiometer].append((n, offsets[selection],
+                                      headers[selection]))
+
+    writer = WRITERS[extension](output)
+    writer.set_attributes({"sequence": path.basename(seq_path),
+                           "meteo": read_meteo(seq_path), **header})
+
+    # Block position, timestamp and pan-tilt of each file from metadata.txt
+    rows = {filename: n for n, filename in enumerate(metadata["filename"])}
+    index = np.array([rows.get(name, -1) for name in names], dtype=np.int64)
+    blocks = np.zeros(len(names), dtype=metadata.dtype)
+    blocks["datetime"] = np.datetime64("NaT")
+    for field in metadata.dtype.names[3:]:
+        blocks[field] = np.nan
+    blocks[index >= 0] = metadata[index[index >= 0]]
+
+    writer.write("files/name", np.array(names, dtype=str), ("file", ))
+    writer.write("files/block_position", blocks["block"].astype(str),
+                 ("file", ))
+    writer.write("files/datetime",
+                 np.datetime_as_string(blocks["datetime"]), ("file", ))
+    for key in ("ask", "abs", "ref"):
+        writer.write(f"files/pt_{key}",
+                     np.stack([blocks[f"pan_{key}"], blocks[f"tilt_{key}"]],
+                              axis=1), ("file", "pan_tilt"))
+
+    datetimes, lx = read_monitor_pd(seq_path)
+    writer.write("monitor_pd/datetime", datetimes, ("monitor_pd_sample", ))
+    writer.write("monitor_pd/lx", lx, ("monitor_pd_sample", ))
+
+    # Second pass : counts, one spectra file at a time
+    for radiometer, per_file in scans.items():
+        n_scans = sum(len(offsets) for _, offsets, _ in per_file)
+        if n_scans == 0:
+            continue
+
+        pixel_counts = np.unique(np.concatenate([h["pixel_count"]
+                                                 for _, _, h in per_file]))
+        if len(pixel_counts) != 1:
+            raise ValueError(f"Several {radiometer} pixel counts : "
+                             f"{pixel_counts}")
+        n_pixels = int(pixel_counts[0])
+
+        dims = (f"{radiometer}_scan", f"{radiometer}_pixel")
+        counts = writer.create_dataset(f"{radiometer}/counts",
+                                       (n_scans, n_pixels), np.uint16, dims)
+        writer.write(f"{radiometer}/file",
+                     np.concatenate([np.full(len(offsets), n, dtype=np.int32)
+                                     for n, offsets, _ in per_file]),
+                     dims[:1])
+        headers = np.concatenate([h for _, _, h in per_file])
+        for field in HEADER_DTYPE.names:
+            writer.write(f"{radiometer}/{field}", headers[field], dims[:1])
+
+        start = 0
+        for n, offsets, _ in per_file:
+            if not len(offsets):
+                continue
+            with open(spectra_files[n], 'rb') as fd:
+                buffer = fd.read()
+            counts[start:start + len(offsets)] = \
+                read_counts(buffer, offsets, n_pixels)
+            start += len(offsets)
+
+        info(f"{radiometer} : {n_scans} scans of {n_pixels} pixels")
+
+    writer.close()
+    info(f"Sequence exported to {output}")
+    return output
+
+
+if __name__ == '__main__':
+    from logging import basicConfig, INFO
+
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--sequence", type=str, required=True,
+                        nargs='+', help="Sequence directory (SEQ...)")
+
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Output file (.h5, .nc or .npz), only for one "
+                             "sequence (default : <sequence>.npz)")
+
+    parser.add_argument("-f", "--format", type=str, default=".npz",
+                        choices=list(WRITERS),
+                        help="Output format if no output file is given")
+
+    parser.add_argument("-V", "--verify", action='store_true', default=False,
+                        help="Export only records with a valid CRC")
+
+    args = parser.parse_args()
+
+    log_fmt = '[%(levelname)-7s %(asctime)s] (%(module)s) %(message)s'
+    basicConfig(level=INFO, format=log_fmt, datefmt='%Y-%m-%dT%H:%M:%S')
+
+    if args.output is not None and len(args.sequence) != 1:
+        parser.error("--output can only be used with one sequence")
+
+    for sequence in args.sequence:
+        output = args.output
+        if output is None:
+            output = path.normpath(sequence) + args.format
+        export_sequence(sequence, output, verify=args.verify)
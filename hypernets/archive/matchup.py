@@ -0,0 +1,151 @@
+"""
+Time-window matchups of overpass times with the sequences of the catalog.
+
+The start times of the sequences and the timestamps of the files (the
+now_str of metadata.txt) of the catalog are loaded once into sorted arrays.
+All the overpasses are then matched at once with two searchsorted : every
+sequence and block within +/- window of each overpass.
+
+    python -m hypernets.archive.matchup -c catalog.db -f overpasses.txt \\
+        -w 30 -e rad
+"""
+
+from argparse import ArgumentParser
+from contextlib import closing
+from sys import stdout
+
+import numpy as np
+
+from hypernets.abstract.name_convention import ENTRANCES
+from hypernets.archive.catalog import connect
+
+from logging import info
+
+
+def expand_ranges(starts, stops):
+    """
+    Index of the query and position in the sorted array of every match
+    from [start, stop) ranges.
+    """
+    counts = stops - starts
+    queries = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    return queries, np.repeat(starts, counts) + offsets
+
+
+def match_times(sorted_times, times, window):
+    """ Matches of 'times' (datetime64) within +/- 'window' (timedelta64). """
+    starts = np.searchsorted(sorted_times, times - window, side='left')
+    stops = np.searchsorted(sorted_times, times + window, side='right')
+    return expand_ranges(starts, stops)
+
+
+class MatchupIndex(object):
+    """
+    Sorted time index of the sequences and of the files of a catalog.
+    """
+    def __init__(self, connection, entrance=None):
+        rows = connection.execute(
+            "SELECT path, datetime FROM sequences "
+            "WHERE datetime IS NOT NULL ORDER BY datetime").fetchall()
+        self.sequences = np.array([row[0] for row in rows], dtype=object)
+        self.sequence_times = np.array([row[1] for row in rows],
+                                       dtype='datetime64[s]')
+
+        query = "SELECT sequences.path, blocks.name, files.name, " \
+            "files.datetime FROM files " \
+            "JOIN sequences ON files.sequence_id = sequences.id " \
+            "LEFT JOIN blocks ON files.block_id = blocks.id " \
+            "WHERE files.datetime IS NOT NULL"
+        parameters = []
+        if entrance is not None:
+            query += " AND files.entrance = ?"
+            parameters.append(ENTRANCES[entrance])
+        rows = connection.execute(query + " ORDER BY files.datetime",
+                                  parameters).fetchall()
+
+        self.files = np.array([row[:3] for row in rows],
+                              dtype=object).reshape(-1, 3)
+        self.file_times = np.array([row[3] for row in rows],
+                                   dtype='datetime64[s]')
+
+        info(f"Matchup index of {len(self.sequences)} sequences and "
+             f"{len(self.files)} files.")
+
+    def match_sequences(self, times, window):
+        """
+        Overpass index, sequence path, start time and time difference (s) of
+        the sequences starting within +/- window of the overpasses.
+        """
+        times = np.asarray(times, dtype='datetime64[s]')
+        queries, matches = match_times(self.sequence_times, times, window)
+        return queries, self.sequences[matches], \
+            self.sequence_times[matches], \
+            (self.sequence_times[matches] - times[queries]).astype(np.int64)
+
+    def match_files(self, times, window):
+        """
+        Overpass index, (sequence, block, file) names, timestamp and time
+        difference (s) of the files within +/- window of the overpasses.
+        """
+        times = np.asarray(times, dtype='datetime64[s]')
+        queries, matches = match_times(self.file_times, times, window)
+        return queries, self.files[matches], self.file_times[matches], \
+            (self.file_times[matches] - times[queries]).astype(np.int64)
+
+
+if __name__ == '__main__':
+    from logging import basicConfig, INFO
+
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--catalog", type=str, default="catalog.db",
+                        help="SQLite catalog (see hypernets.archive.catalog)")
+
+    parser.add_argument("-t", "--time", type=str, nargs='+', default=[],
+                        help="Overpass times (ISO, UTC)")
+
+    parser.add_argument("-f", "--file", type=str, default=None,
+                        help="File of overpass times (one ISO time per line)")
+
+    parser.add_argument("-w", "--window", type=float, default=30,
+                        help="Half width of the time window (minutes)")
+
+    parser.add_argument("-e", "--entrance", type=str, default=None,
+                        choices=list(ENTRANCES),
+                        help="Only files of this entrance")
+
+    parser.add_argument("-s", "--sequences-only", action='store_true',
+                        default=False, help="Match sequence start times only")
+
+    args = parser.parse_args()
+
+    log_fmt = '[%(levelname)-7s %(asctime)s] (%(module)s) %(message)s'
+    basicConfig(level=INFO, format=log_fmt, datefmt='%Y-%m-%dT%H:%M:%S')
+
+    times = list(args.time)
+    if args.file is not None:
+        with open(args.file) as fd:
+            times += [line.strip() for line in fd if line.strip()]
+
+    times = np.array([t.rstrip("Z") for t in times], dtype='datetime64[s]')
+    window = np.timedelta64(int(args.window * 60), 's')
+
+    with closing(connect(args.catalog)) as connection:
+        index = MatchupIndex(connection, args.entrance)
+
+    if args.sequences_only:
+        queries, sequences, seq_times, deltas = \
+            index.match_sequences(times, window)
+        stdout.write("overpass,sequence,datetime,delta_s\n")
+        for row in zip(times[queries], sequences, seq_times, deltas):
+            stdout.write(",".join(str(value) for value in row) + "\n")
+    else:
+        queries, files, file_times, deltas = index.match_files(times, window)
+        stdout.write("overpass,sequence,block,file,datetime,delta_s\n")
+        for overpass, names, file_time, delta in zip(times[queries], files,
+                                                      file_times, deltas):
+            stdout.write(f"{overpass},{','.join(str(n) for n in names)},"
+                         f"{file_time},{delta}\n")
+
+    info(f"{len(queries)} matchups for {len(times)} overpasses.")
@@ -209,62 +209,71 @@ def move_to(ser, pan=None, tilt=None, wait=False, tilt_limiter=True):
         debug("Tilt Request :\t%s" % stringifyBinaryToHex(data))
 
     if wait:
-        # full tilt rotation takes 65s at 10.8V supply, 58s at 12V
-        # estimated_time can be unknown or miscalculated so we can't use that
-        max_time_to_wait = 65 # seconds
-        start_time = datetime.now(timezone.utc)
-
-        i = 0
-        position_0 = None
-
-        while True:
-            i += 1
-            debug(f"{'-'*29} {i} {'-'*29}")
-            position_1 = query_position(ser)
-            time_1 = datetime.now(timezone.utc)
-
-            # time is up
-            # either we can't get position from the pan-tilt
-            # or the supply voltage is very low
-            # or the movement is mechanically blocked by something
-            if (time_1 - start_time).total_seconds() > max_time_to_wait:
-                debug("Movement takes too long, giving up")
-                break
-
-            # pan-tilt didn't respond, retry
-            if position_1 is None:
-                continue
-
-            # no second position yet
-            if position_0 is None:
-                position_0 = position_1
-                time_0 = time_1
-                sleep(1)
-                continue
-
-            debug(f"Position 0 : {position_0[0]/100}, {position_0[1]/100}")
-            debug(f"Position 1 : {position_1[0]/100}, {position_1[1]/100}")
-            debug("Estimated velocity : ")
-            delta_t = (time_1 - time_0).total_seconds()
-            debug(f"pan : {(position_1[0] - position_0[0]) / (100 * delta_t):.1f}, "
-                  f"tilt : {(position_1[1] - position_0[1]) / (100 * delta_t):.1f} "
-                  "(degrees.s^-1)")
-
-            if (abs(position_0[0] - position_1[0]) <= 20 and
-                     abs(position_0[1] - position_1[1]) <= 10):
-                debug("Reached the destination")
-                debug("-"*60)
-                break
-            else:
-                debug("Not there yet")
-                position_0 = position_1
-                time_0 = time_1
-                sleep(1)
-                continue
-
-        info(f"Final position :\t{position_1}\t(10^-2 degrees)")
-        ser.close()
-        return position_1
+        return wait_for_position(ser)
+
+
+def wait_for_position(ser=None, max_time_to_wait=65):
+    """
+    Waits until the pan-tilt stops moving, returns its final position.
+    """
+    if ser is None:
+        ser = open_serial()
+
+    # full tilt rotation takes 65s at 10.8V supply, 58s at 12V
+    # estimated_time can be unknown or miscalculated so we can't use that
+    start_time = datetime.now(timezone.utc)
+
+    i = 0
+    position_0 = None
+
+    while True:
+        i += 1
+        debug(f"{'-'*29} {i} {'-'*29}")
+        position_1 = query_position(ser)
+        time_1 = datetime.now(timezone.utc)
+
+        # time is up
+        # either we can't get position from the pan-tilt
+        # or the supply voltage is very low
+        # or the movement is mechanically blocked by something
+        if (time_1 - start_time).total_seconds() > max_time_to_wait:
+            debug("Movement takes too long, giving up")
+            break
+
+        # pan-tilt didn't respond, retry
+        if position_1 is None:
+            continue
+
+        # no second position yet
+        if position_0 is None:
+            position_0 = position_1
+            time_0 = time_1
+            sleep(1)
+            continue
+
+        debug(f"Position 0 : {position_0[0]/100}, {position_0[1]/100}")
+        debug(f"Position 1 : {position_1[0]/100}, {position_1[1]/100}")
+        debug("Estimated velocity : ")
+        delta_t = (time_1 - time_0).total_seconds()
+        debug(f"pan : {(position_1[0] - position_0[0]) / (100 * delta_t):.1f}, "
+              f"tilt : {(position_1[1] - position_0[1]) / (100 * delta_t):.1f} "
+              "(degrees.s^-1)")
+
+        if (abs(position_0[0] - position_1[0]) <= 20 and
+                 abs(position_0[1] - position_1[1]) <= 10):
+            debug("Reached the destination")
+            debug("-"*60)
+            break
+        else:
+            debug("Not there yet")
+            position_0 = position_1
+            time_0 = time_1
+            sleep(1)
+            continue
+
+    info(f"Final position :\t{position_1}\t(10^-2 degrees)")
+    ser.close()
+    return position_1
 
 
 def move_to_geometry(geometry, wait=False, tilt_limiter=True):
@@ -0,0 +1,51 @@
+"""
+Order of the pan-tilt positions of a protocol block (see
+Protocol.reorder_geometries) : open path through a cost matrix.
+"""
+
+
+def plan_path(costs, start_costs=None, end_costs=None):
+    """
+    Order of the nodes of a (symmetric) cost matrix minimising the cost of
+    the path through all of them, from a start and to an end node (costs to
+    reach each node, free if None) : nearest neighbour then 2-opt.
+    """
+    n = len(costs)
+    if n < 2:
+        return list(range(n))
+
+    # start and end as extra nodes n and n + 1
+    start_costs = start_costs or [0.] * n
+    end_costs = end_costs or [0.] * n
+    costs = [list(row) + [s, e] for row, s, e in
+             zip(costs, start_costs, end_costs)]
+    costs.append(list(start_costs) + [0., 0.])
+    costs.append(list(end_costs) + [0., 0.])
+
+    def path_cost(path):
+        return sum(costs[a][b] for a, b in zip(path[:-1], path[1:]))
+
+    def nearest_neighbour(first):
+        path, left = [n, first], set(range(n)) - {first}
+        while left:
+            path.append(min(left, key=lambda j: (costs[path[-1]][j], j)))
+            left.remove(path[-1])
+        return path + [n + 1]
+
+    # every first node, unless the start is fixed
+    firsts = [min(range(n), key=lambda j: (start_costs[j], j))] \
+        if any(start_costs) else range(n)
+    path = min((nearest_neighbour(first) for first in firsts), key=path_cost)
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n):
+            for j in range(i + 1, n + 1):
+                a, b, c, d = path[i - 1], path[i], path[j], path[j + 1]
+                if costs[a][c] + costs[b][d] < \
+                        costs[a][b] + costs[c][d] - 1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    improved = True
+
+    return path[1:-1]
@@ -5,7 +5,11 @@ import warnings
 from logging import info, debug, error
 
 
-def spa_from_datetime(now=None, quiet=False):
+def spa_from_datetime(now=None, quiet=False, location=None):
+    """
+    Sun azimuth and zenith at the location (latitude, longitude) of
+    config_dynamic.ini, or at the given one.
+    """
 
     if now is None:
         now = datetime.now(timezone.utc)
@@ -19,8 +23,11 @@ def spa_from_datetime(now=None, quiet=False):
     except KeyError:
         elevation = 0.0
 
-    latitude = float(config["GPS"]["latitude"])
-    longitude = float(config["GPS"]["longitude"])
+    if location is not None:
+        latitude, longitude = location
+    else:
+        latitude = float(config["GPS"]["latitude"])
+        longitude = float(config["GPS"]["longitude"])
 
     debug(f"Latitude from config : {latitude}")
     debug(f"Longitude from config : {longitude}")
@@ -333,7 +333,8 @@ class FrameRadiometer(LabelFrame):
             self.figure, self.axes = plt.subplots()
             plt.subplots_adjust(bottom=0.2)
             self.spectra = Spectra(self.last_file_path, figure=self.figure,
-                                   axes=self.axes, cc=self.calibration_coefficients)
+                                   axes=self.axes, cc=self.calibration_coefficients,
+                                   lazy=True)
             self.update_output()
         else:
             self.figure, self.axes = plt.subplots()
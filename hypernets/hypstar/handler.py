@@ -6,6 +6,7 @@ from os.path import exists, islink
 from argparse import ArgumentParser
 
 from hypernets.abstract.request import Request, EntranceExt, RadiometerExt, InstrumentAction
+from hypernets.reader.sidecar import SpectraWriter
 
 from hypernets.hypstar.libhypstar.python.hypstar_wrapper import Hypstar, \
     wait_for_instrument
@@ -24,6 +25,10 @@ from hypernets.hypstar.libhypstar.python.data_structs.spectrum_raw  \
 from logging import debug, info, warning, error
 
 
+# Memory slots downloaded (and written) at once by take_spectra
+SLOT_BATCH = 64
+
+
 class HypstarHandler(Hypstar):
     def __init__(self, instrument_port="/dev/radiometer0",
                  instrument_baudrate=115200, instrument_loglevel=3,
@@ -121,7 +126,8 @@ class HypstarHandler(Hypstar):
              warning(f"{instrument_port} is not a link!")
 
 
-    def take_request(self, request, path_to_file=None, gui=False):
+    def take_request(self, request, path_to_file=None, gui=False,
+                     write_behind=None):
 
         if path_to_file is None:
             from os import path, mkdir
@@ -131,28 +137,34 @@ class HypstarHandler(Hypstar):
                 mkdir("DATA", mode=0o755)
 
         if request.action == InstrumentAction.PICTURE:
-            self.take_picture(path_to_file)
+            self.take_picture(path_to_file, write_behind=write_behind)
 
         elif request.action == InstrumentAction.VALIDATION:
-            self.take_validation(request, path_to_file)
+            self.take_validation(request, path_to_file, write_behind)
 
         elif request.action == InstrumentAction.MEASUREMENT:
-            self.take_spectra(request, path_to_file)
+            self.take_spectra(request, path_to_file,
+                              write_behind=write_behind)
 
         return path_to_file
 
 
-    def take_picture(self, path_to_file, params=None, return_stream=False):
+    def take_picture(self, path_to_file, params=None, return_stream=False,
+                     write_behind=None):
         # Note : 'params = None' for now, only 5MP is working
         try:
             self.packet_count = self.capture_JPEG_image(flip=True)
             if not self.packet_count:
                 return False
             stream = self.download_JPEG_image()
-            with open(path_to_file, 'wb') as f:
-                f.write(stream)
-
-            info(f"Saved to {path_to_file}")
+            if write_behind is not None:
+                write_behind.file(path_to_file, stream)
+                info(f"Queued for {path_to_file}")
+            else:
+                with open(path_to_file, 'wb') as f:
+                    f.write(stream)
+
+                info(f"Saved to {path_to_file}")
             if return_stream:
                 return stream
             return True
@@ -162,7 +174,8 @@ class HypstarHandler(Hypstar):
             return e
 
 
-    def take_spectra(self, request, path_to_file, overwrite_IT=True):
+    def take_spectra(self, request, path_to_file, overwrite_IT=True,
+                     write_behind=None):
 
         try:
             cap_count = self.capture_spectra(request.radiometer,
@@ -173,37 +186,41 @@ class HypstarHandler(Hypstar):
                                              request.total_measurement_time)
 
             slot_list = self.get_last_capture_spectra_memory_slots(cap_count)
-            cap_list = self.download_spectra(slot_list)
 
-            if len(cap_list) == 0:
+            if len(slot_list) == 0:
                 return Exception("Cap list length is zero!")
 
-            # Concatenation
-            spectra = b''
+            # Download by batches of slots, each written as it arrives (or
+            # queued record by record with write_behind). Slices of the ctypes
+            # array of slots are lists, the wrapper expects a ctypes array.
+            if write_behind is not None:
+                writer = write_behind.spectra(path_to_file)
+            else:
+                writer = SpectraWriter(path_to_file)
+
             spec_it = [None, None]
-            for n, spectrum in enumerate(cap_list):
-                spectra += spectrum.getBytes()
-
-                debug(spectrum)
-
-                if spectrum.spectrum_header.spectrum_config.vnir:
-                    spec_it[0] = spectrum.spectrum_header.integration_time_ms
-                    if overwrite_IT:
-                        request.it_vnir = \
-                            spectrum.spectrum_header.integration_time_ms
-                elif spectrum.spectrum_header.spectrum_config.swir:
-                    spec_it[1] = spectrum.spectrum_header.integration_time_ms
-                    if overwrite_IT:
-                        request.it_swir = \
-                            spectrum.spectrum_header.integration_time_ms
+            with writer:
+                for start in range(0, len(slot_list), SLOT_BATCH):
+                    batch = slot_list[start:start + SLOT_BATCH]
+                    batch = (slot_list._type_ * len(batch))(*batch)
+                    for spectrum in self.download_spectra(batch):
+                        writer.write(spectrum.getBytes())
+
+                        debug(spectrum)
+
+                        header = spectrum.spectrum_header
+                        if header.spectrum_config.vnir:
+                            spec_it[0] = header.integration_time_ms
+                            if overwrite_IT:
+                                request.it_vnir = header.integration_time_ms
+                        elif header.spectrum_config.swir:
+                            spec_it[1] = header.integration_time_ms
+                            if overwrite_IT:
+                                request.it_swir = header.integration_time_ms
 
             # Log integration times
             info(f"Integration time: {spec_it}")
 
-            # Save
-            with open(path_to_file, "wb") as f:
-                f.write(spectra)
-
             info(f"Saved to {path_to_file}.")
 
         except Exception as e:
@@ -213,7 +230,7 @@ class HypstarHandler(Hypstar):
         return True
 
 
-    def take_validation(self, request, path_to_file):
+    def take_validation(self, request, path_to_file, write_behind=None):
         try:
             self.VM_enable(True)
 
@@ -222,12 +239,14 @@ class HypstarHandler(Hypstar):
             spectra = self.VM_measure(request.entrance, request.radiometer, request.it_vnir, int(request.vm_current_ma)/1000, request.number_cap)
             # spectra = self.VM_measure(request.entrance, ValidationModuleLightType.LIGHT_VIS, request.it_vnir, 1.0, scan_count=request.number_cap)
 
-            spectra_bin = b''
-            for n, spectrum in enumerate(spectra):
-                spectra_bin += spectrum.getBytes()
+            if write_behind is not None:
+                writer = write_behind.spectra(path_to_file)
+            else:
+                writer = SpectraWriter(path_to_file)
 
-            with open(path_to_file, "wb") as f:
-                f.write(spectra_bin)
+            with writer:
+                for spectrum in spectra:
+                    writer.write(spectrum.getBytes())
 
             info(f"Saved to {path_to_file}.")
 
@@ -0,0 +1,169 @@
+"""
+Write-behind queue of the files of a sequence.
+
+The spectra, pictures and metadata of a sequence are written by a writer
+thread, in the order they are queued, so the acquisition goes on with the
+next pan-tilt move while the SD card is busy. Spectra are queued record by
+record as they are downloaded, a picture or a metadata block as a whole. The
+queue is bounded : when it is full, the acquisition waits (back-pressure) and
+it is logged.
+
+    write_behind = WriteBehind()
+    instrument.take_request(request, output, write_behind=write_behind)
+    write_behind.put(mdfile.write, block_metadata)
+    write_behind.sync(mdfile)   # block boundary
+    ...
+    write_behind.close()        # everything written and synced
+"""
+
+from atexit import register, unregister
+from os import fsync
+from queue import Queue, Full
+from threading import Thread
+from time import time
+
+from hypernets.reader.sidecar import SpectraWriter
+
+from logging import debug, info, warning, error
+
+
+# Writes (spectra records, pictures...) waiting in the queue before the
+# acquisition waits
+MAX_PENDING = 16
+
+# Waits (s) of the acquisition that are logged as back-pressure
+STALL_WARNING = 0.1
+
+
+class SpectraPayload(object):
+    """
+    Spectra file written by the writer thread record by record, as they are
+    queued (same interface as SpectraWriter) : only the records waiting in
+    the queue are kept in memory.
+    """
+    def __init__(self, write_behind, path_to_file):
+        self.write_behind = write_behind
+        self.path_to_file = path_to_file
+        self.nb_records = 0
+        self.closed = False
+        self.writer = None
+
+    def __len__(self):
+        return self.nb_records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, record):
+        self.write_behind.put(self.write_record, record)
+        self.nb_records += 1
+
+    def close(self):
+        if self.closed:
+            return
+        self.write_behind.put(self.close_writer)
+        self.closed = True
+
+    # Writer thread
+    def write_record(self, record):
+        if self.writer is None:
+            self.writer = SpectraWriter(self.path_to_file)
+        self.writer.write(record)
+
+    def close_writer(self):
+        if self.writer is None:
+            self.writer = SpectraWriter(self.path_to_file)
+        self.writer.close()
+        debug(f"Written : {self.path_to_file}")
+
+
+def write_file(path_to_file, data):
+    with open(path_to_file, "wb") as fd:
+        fd.write(data)
+        fd.flush()
+        fsync(fd.fileno())
+    debug(f"Written : {path_to_file}")
+
+
+def sync_file(fd):
+    fd.flush()
+    fsync(fd.fileno())
+
+
+class WriteBehind(object):
+    def __init__(self, max_pending=MAX_PENDING):
+        self.queue = Queue(maxsize=max_pending)
+        self.nb_writes, self.nb_errors, self.stall_time = 0, 0, 0.
+
+        # Daemon thread, but what is queued is still written at exit
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        register(self.close)
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    break
+                function, args = job
+                function(*args)
+                self.nb_writes += 1
+
+            except Exception as e:
+                error(f"(write-behind) {e}")
+                self.nb_errors += 1
+
+            finally:
+                self.queue.task_done()
+
+    def put(self, function, *args):
+        """ Queues function(*args), waits if the queue is full. """
+        if not self.thread.is_alive():
+            raise RuntimeError("Write-behind queue is closed")
+
+        start = time()
+        self.queue.put((function, args))
+        stall = time() - start
+
+        self.stall_time += stall
+        if stall > STALL_WARNING:
+            warning(f"Write-behind queue full, acquisition waited "
+                    f"{stall:.2f} s")
+
+    def spectra(self, path_to_file):
+        return SpectraPayload(self, path_to_file)
+
+    def file(self, path_to_file, data):
+        self.put(write_file, path_to_file, data)
+
+    def sync(self, fd):
+        """ Syncs an open file once everything queued before is written. """
+        self.put(sync_file, fd)
+
+    def close(self, timeout=None):
+        """
+        Waits (at most 'timeout' s) for the queued writes, returns the number
+        of failed ones.
+        """
+        if self.thread.is_alive():
+            start = time()
+            try:
+                self.queue.put(None, timeout=timeout)
+                self.thread.join(None if timeout is None else
+                                 max(0, timeout - (time() - start)))
+            except Full:
+                pass
+
+            if self.thread.is_alive():
+                warning(f"Write-behind : queued writes not done after "
+                        f"{timeout} s")
+                return self.nb_errors
+
+            unregister(self.close)
+            info(f"Write-behind : {self.nb_writes} writes, {self.nb_errors} "
+                 f"errors, acquisition waited {self.stall_time:.1f} s")
+        return self.nb_errors
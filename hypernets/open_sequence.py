@@ -1,6 +1,8 @@
 
 from argparse import ArgumentParser
 
+from functools import partial
+
 from datetime import datetime, timezone
 from time import time, sleep
 from os import mkdir, replace, path
@@ -13,15 +15,18 @@ from hypernets.abstract.create_metadata import parse_config_metadata
 from hypernets.abstract.request import InstrumentAction
 
 from hypernets.hypstar.handler import HypstarHandler
+from hypernets.hypstar.write_behind import WriteBehind
 from hypernets.hypstar.libhypstar.python.hypstar_wrapper import HypstarLogLevel
 from hypernets.hypstar.libhypstar.python.data_structs.environment_log import get_csv_header
+from hypernets.hypstar.libhypstar.python.data_structs.spectrum_raw import RadiometerEntranceType
 
 from logging import debug, info, warning, error, getLogger, INFO
 
 from hypernets.rain_sensor import RainSensor
 
 from hypernets.abstract.geometry import Geometry
-from hypernets.geometry.pan_tilt import move_to_geometry, move_to, NoGoZoneError
+from hypernets.geometry.pan_tilt import move_to_geometry, move_to, \
+    wait_for_position, NoGoZoneError
 
 from hypernets.yocto.lightsensor_logger import start_lightsensor_thread, terminate_lightsensor_thread
 from hypernets.yocto.relay import set_state_relay
@@ -31,6 +36,10 @@ from hypernets.yocto.sleep_monitor import getPoweroffCountdown
 yoctoWDTflag = threading.Event()
 tilt_limiter = True
 
+# Write-behind queue of the running sequence, drained before an abort
+active_write_behind = None
+WRITE_BEHIND_TIMEOUT = 30
+
 class yoctoWathdogTimeout(Exception):
     pass
 
@@ -40,7 +49,9 @@ def run_sequence_file(sequence_file, instrument_port, instrument_br, # noqa C901
                       instrument_standalone=False,
                       instrument_swir_tec=0,
                       DATA_DIR="DATA",
-                      check_rain=False):
+                      check_rain=False,
+                      write_behind=True,
+                      overlap_dark=False):
 
     ## check tilt limiter
     ## if key is missing, defaults False
@@ -48,6 +59,7 @@ def run_sequence_file(sequence_file, instrument_port, instrument_br, # noqa C901
     ##
     ## use global variable because we need to access it in park_to_nadir()
     global tilt_limiter
+    global active_write_behind
 
     if instrument_standalone:
         tilt_limiter = False
@@ -93,6 +105,14 @@ def run_sequence_file(sequence_file, instrument_port, instrument_br, # noqa C901
         error("Wrong syntax in sequence file?")
         exit(1)
 
+    # Geometries between "~ #reorderable" and "~ #ordered" markers
+    if protocol.reorderable:
+        try:
+            protocol.reorder_geometries()
+        except Exception as e:
+            error(f"{e}")
+            error("Failed to reorder the geometries, protocol order is kept")
+
     info(protocol)
 
     # check if this protocol wants to use instrument
@@ -224,6 +244,16 @@ def run_sequence_file(sequence_file, instrument_port, instrument_br, # noqa C901
     mdfile.write(parse_config_metadata(sequence_file = sequence_file, 
                                        instrument_sn = instrument_sn, vm_sn = vm_sn))
 
+    # Files and metadata are written by a writer thread (in order), so the
+    # acquisition doesn't wait for the SD card
+    if write_behind:
+        write_behind = WriteBehind()
+        write_metadata = partial(write_behind.put, mdfile.write)
+        active_write_behind = write_behind
+    else:
+        write_behind = None
+        write_metadata = mdfile.write
+
     # Start yocto watchdog timeout monitor thread
     # Exit if yocto watchdog timer expires in less than timeout_s seconds
     # timeout_s should be long enough for finishing any pending pan-tilt movements 
@@ -275,6 +305,155 @@ def run_sequence_file(sequence_file, instrument_port, instrument_br, # noqa C901
     # print env log header
     info(get_csv_header())
 
+    def move_with_retries(geometry):
+        """ Moves to a geometry, returns (pan_real, tilt_real, skip). """
+        pan_real, tilt_real, skip_geometry = -999, -999, False
+
+        # try up to 2 times moving the pan-tilt
+        logger = getLogger()
+        old_loglevel = logger.level
+        for i in range(2):
+            # if yocto watchdog timeout is imminent
+            # wait here for threadingExceptionHook exit instead of moving pan-tilt
+            if yoctoWDTflag.is_set():
+                yoctoWDTwatcher.join()
+
+            try:
+                pan_real, tilt_real = move_to_geometry(geometry, wait=True, tilt_limiter=tilt_limiter)
+                pan_real = float(pan_real) / 100
+                tilt_real = float(tilt_real) / 100
+
+                if check_position(geometry, pan_real, tilt_real):
+                    break
+                logger.setLevel(DEBUG)
+
+            except TypeError:
+                warning(f"Failed to read the final position from pan-tilt")
+                pan_real, tilt_real = -999, -999
+
+            except NoGoZoneError as e:
+                error(f"{e}")
+                error("Skipping this geometry !!")
+                skip_geometry = True
+                break
+
+            except Exception as e:
+                error(f"{e}")
+                # Don't retry if this was the first attempt
+                break
+
+        logger.setLevel(old_loglevel)
+        return pan_real, tilt_real, skip_geometry
+
+    def wait_for_geometry(geometry):
+        """
+        Waits for the end of a move issued without waiting, moves again if
+        the position isn't reached. Returns (pan_real, tilt_real).
+        """
+        try:
+            pan_real, tilt_real = wait_for_position()
+            pan_real = float(pan_real) / 100
+            tilt_real = float(tilt_real) / 100
+            if check_position(geometry, pan_real, tilt_real):
+                return pan_real, tilt_real
+
+        except TypeError:
+            warning(f"Failed to read the final position from pan-tilt")
+
+        except Exception as e:
+            error(f"{e}")
+
+        pan_real, tilt_real, _ = move_with_retries(geometry)
+        return pan_real, tilt_real
+
+    def write_block(block, pan_real, tilt_real):
+        # FIXME : quickfix when standalone
+        if instrument_standalone:
+            pan_real, tilt_real = 0.0, 0.0
+        block += f"pt_ref={pan_real:.2f}; {tilt_real:.2f}\n"
+
+        # Queued after the file of the block : metadata.txt never lists
+        # a file that isn't on the disk
+        write_metadata(block)
+        if write_behind is not None:
+            write_behind.sync(mdfile)
+
+    def run_request(geometry, request, pan_real, tilt_real, line=None,
+                    pending=None):
+        """
+        Runs a request as line 'line' of the sequence (next line if None).
+        Its metadata block is appended to 'pending' (written by write_block
+        once the position is known) instead of written if not None.
+        """
+        nonlocal iter_line, nb_error
+
+        if not instrument_standalone:
+            # if yocto watchdog timeout is imminent
+            # wait here for threadingExceptionHook exit instead of sending radiometer request 
+            if yoctoWDTflag.is_set():
+                yoctoWDTwatcher.join()
+
+        if line is None:
+            iter_line += 1
+            line = iter_line
+
+        block_position = geometry.create_block_position_name(line)
+        now_str = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+
+        info(f"{line}) {request} : {now_str}")
+
+        filename = request.spectra_name_convention(prefix=block_position)
+        output = path.join(filepath, filename)
+
+        try:
+            # 0xFF returns live data, 0 returns last captured on FW > 0.15.24
+            if (instrument_FW_major, instrument_FW_minor, instrument_FW_rev) > (0, 15, 24):
+                env_request = 0xff 
+            else:
+                env_request = 0
+
+            env = instrument_instance.get_env_log(env_request)
+            # dump instrument environmental log at all log levels
+            force_log_info(env.get_csv_line())
+            instrument_instance.take_request(request, path_to_file=output,
+                                             write_behind=write_behind)
+
+        except Exception as e:
+            if request.action == InstrumentAction.VALIDATION:
+                error("LED source measurement failed, aborting sequence")
+                if not instrument_standalone:
+                    park_to_nadir()
+                exit(78) # exit code 78
+
+            error(f"Error : {e}")
+            nb_error += 1
+
+
+        flags_dict[f"$spectra_file{line}.it_vnir"] = request.it_vnir
+        flags_dict[f"$spectra_file{line}.it_swir"] = request.it_swir
+
+        block = f"\n[{block_position}]\n{filename}={now_str}\n"
+
+        # Write p/t values each blocks for backward compatibility
+        block += f"pt_ask={geometry.pan:.2f}; {geometry.tilt:.2f}\n"
+        block += f"pt_abs={geometry.pan_abs:.2f};" \
+            f"{geometry.tilt_abs:.2f}\n"
+
+        if pending is not None:
+            pending.append(block)
+        else:
+            write_block(block, pan_real, tilt_real)
+
+    # With overlap_dark, the pan-tilt move is issued without waiting : the
+    # darks that follow the last light measurement of the previous geometry
+    # run during the move, and the position is only awaited before the
+    # first request that depends on it. Deferred darks keep the line (and
+    # $spectra_fileN) numbers of the protocol order, but their flag variables
+    # are only set once they have run, after the flags of the next geometry
+    # are checked.
+    overlap_dark = overlap_dark and not instrument_standalone
+    deferred_darks, arrived = [], True
+
     iter_line, nb_error = 0, 0
     for i, (geometry, requests) in enumerate(protocol, start=1):
 
@@ -322,117 +501,79 @@ def run_sequence_file(sequence_file, instrument_port, instrument_br, # noqa C901
             continue
 
         info("-"*72)
+        pan_real, tilt_real, skip_geometry = -999, -999, False
+        arrived = True
         if not instrument_standalone:
-            skip_geometry = False
-
             geometry.get_absolute_pan_tilt()
             info(f"--> Requested Position : {geometry}")
 
-            # try up to 2 times moving the pan-tilt
-            logger = getLogger()
-            old_loglevel = logger.level
-            for i in range(2):
-                # if yocto watchdog timeout is imminent
-                # wait here for threadingExceptionHook exit instead of moving pan-tilt
+            if overlap_dark:
                 if yoctoWDTflag.is_set():
                     yoctoWDTwatcher.join()
 
                 try:
-                    pan_real, tilt_real = move_to_geometry(geometry, wait=True, tilt_limiter=tilt_limiter)
-                    pan_real = float(pan_real) / 100
-                    tilt_real = float(tilt_real) / 100
-
-                    pan_delta = ((pan_real - geometry.pan_abs) + 180) % 360 - 180
-                    tilt_delta = ((tilt_real - geometry.tilt_abs) + 180) % 360 - 180
-
-                    if abs(pan_delta) > 1.0 or abs(tilt_delta) > 1.0:
-                        warning(f"pan-tilt did not reach the requested position")
-                        warning(f"--> requested : pan = {geometry.pan_abs:.2f}, tilt = {geometry.tilt_abs:.2f}")
-                        warning(f"--> reported  : pan = {pan_real:.2f}, tilt = {tilt_real:.2f}")
-                        warning(f"--> delta     : pan = {pan_delta:+.1f}, tilt = {tilt_delta:+.1f}") 
-                        logger.setLevel(DEBUG)
-                    else:
-                        info(f"--> final pan (abs) : {pan_real}; final tilt (abs) : {tilt_real}")
-                        info(f"--> from target     : pan = {pan_delta:+.1f}, tilt = {tilt_delta:+.1f}")
-                        info("-"*72)
-                        break
-
-                except TypeError:
-                    warning(f"Failed to read the final position from pan-tilt")
-                    pan_real, tilt_real = -999, -999
+                    move_to_geometry(geometry, wait=False, tilt_limiter=tilt_limiter)
+                    arrived = False
 
                 except NoGoZoneError as e:
                     error(f"{e}")
                     error("Skipping this geometry !!")
                     skip_geometry = True
-                    break
 
                 except Exception as e:
                     error(f"{e}")
-                    # Don't retry if this was the first attempt
-                    break
+            else:
+                pan_real, tilt_real, skip_geometry = move_with_retries(geometry)
 
-            logger.setLevel(old_loglevel)
+        for dark in deferred_darks:
+            run_request(*dark)
+        deferred_darks = []
 
         if skip_geometry is True:
             continue
 
-        for request in requests:
-            if not instrument_standalone:
-                # if yocto watchdog timeout is imminent
-                # wait here for threadingExceptionHook exit instead of sending radiometer request 
-                if yoctoWDTflag.is_set():
-                    yoctoWDTwatcher.join()
-
-            iter_line += 1
-
-            block_position = geometry.create_block_position_name(iter_line)
-            now_str = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
-
-            info(f"{iter_line}) {request} : {now_str}")
-
-            filename = request.spectra_name_convention(prefix=block_position)
-            output = path.join(filepath, filename)
-
-            try:
-                # 0xFF returns live data, 0 returns last captured on FW > 0.15.24
-                if (instrument_FW_major, instrument_FW_minor, instrument_FW_rev) > (0, 15, 24):
-                    env_request = 0xff 
-                else:
-                    env_request = 0
-
-                env = instrument_instance.get_env_log(env_request)
-                # dump instrument environmental log at all log levels
-                force_log_info(env.get_csv_line())
-                instrument_instance.take_request(request, path_to_file=output)
-
-            except Exception as e:
-                if request.action == InstrumentAction.VALIDATION:
-                    error("LED source measurement failed, aborting sequence")
-                    if not instrument_standalone:
-                        park_to_nadir()
-                    exit(78) # exit code 78
-
-                error(f"Error : {e}")
-                nb_error += 1
-
-
-            flags_dict[f"$spectra_file{iter_line}.it_vnir"] = request.it_vnir
-            flags_dict[f"$spectra_file{iter_line}.it_swir"] = request.it_swir
-
-            mdfile.write(f"\n[{block_position}]\n")
-            mdfile.write(f"{filename}={now_str}\n")
-
-            # Write p/t values each blocks for backward compatibility
-            mdfile.write(f"pt_ask={geometry.pan:.2f}; {geometry.tilt:.2f}\n")
-            mdfile.write(f"pt_abs={geometry.pan_abs:.2f};"
-                         f"{geometry.tilt_abs:.2f}\n")
-
-            # FIXME : quickfix when standalone
-            if instrument_standalone:
-                pan_real, tilt_real = 0.0, 0.0
-            mdfile.write(f"pt_ref={pan_real:.2f}; {tilt_real:.2f}\n")
-
+        last_light = max([n for n, request in enumerate(requests)
+                          if not is_dark(request) and
+                          request.action != InstrumentAction.PICTURE],
+                         default=-1)
+
+        pending_blocks = []
+        for n, request in enumerate(requests):
+            if overlap_dark and is_dark(request):
+                if n > last_light:
+                    # run during the move to the next geometry, numbered
+                    # now
+                    iter_line += 1
+                    deferred_darks.append((geometry, request, pan_real,
+                                           tilt_real, iter_line))
+                    continue
+
+                if not arrived:
+                    # run during the move to this geometry, its pt_ref is
+                    # written once the position is reached
+                    run_request(geometry, request, pan_real, tilt_real,
+                                pending=pending_blocks)
+                    continue
+
+            elif not arrived:
+                pan_real, tilt_real = wait_for_geometry(geometry)
+                arrived = True
+                for block in pending_blocks:
+                    write_block(block, pan_real, tilt_real)
+                pending_blocks = []
+
+            run_request(geometry, request, pan_real, tilt_real)
+
+    for dark in deferred_darks:
+        run_request(*dark)
+
+    if not arrived:
+        wait_for_position()
+
+    # Everything is written and synced before the sequence is renamed
+    if write_behind is not None:
+        nb_error += write_behind.close()
+        active_write_behind = None
     mdfile.close()
 
     if not instrument_standalone:
@@ -492,6 +633,29 @@ def run_sequence_file(sequence_file, instrument_port, instrument_br, # noqa C901
         error(f"Error: {e}")
 
 
+def is_dark(request):
+    return request.action == InstrumentAction.MEASUREMENT and \
+        request.entrance == RadiometerEntranceType.DARK
+
+
+def check_position(geometry, pan_real, tilt_real):
+    """ Logs the position reached, False if it's too far from the geometry. """
+    pan_delta = ((pan_real - geometry.pan_abs) + 180) % 360 - 180
+    tilt_delta = ((tilt_real - geometry.tilt_abs) + 180) % 360 - 180
+
+    if abs(pan_delta) > 1.0 or abs(tilt_delta) > 1.0:
+        warning(f"pan-tilt did not reach the requested position")
+        warning(f"--> requested : pan = {geometry.pan_abs:.2f}, tilt = {geometry.tilt_abs:.2f}")
+        warning(f"--> reported  : pan = {pan_real:.2f}, tilt = {tilt_real:.2f}")
+        warning(f"--> delta     : pan = {pan_delta:+.1f}, tilt = {tilt_delta:+.1f}") 
+        return False
+
+    info(f"--> final pan (abs) : {pan_real}; final tilt (abs) : {tilt_real}")
+    info(f"--> from target     : pan = {pan_delta:+.1f}, tilt = {tilt_delta:+.1f}")
+    info("-"*72)
+    return True
+
+
 def is_raining(rain_sensor=None):
     debug("Checking rain sensor")
 
@@ -559,6 +723,9 @@ def threadingExceptionHook(exc):
         yoctoWDTflag.set()
         error(f"Aborting sequence due to Yocto watchdog timeout in {exc.exc_value} seconds")
         park_to_nadir()
+        # os._exit() skips the atexit drain of the write-behind queue
+        if active_write_behind is not None:
+            active_write_behind.close(timeout=WRITE_BEHIND_TIMEOUT)
         os._exit(98) # exit code 98
     else:
         error(f"Caught unhandled threading exception: {exc}")
@@ -616,6 +783,17 @@ if __name__ == '__main__':
                         help="Thermoelectric Cooler Point for the SWIR module",
                         default=0)
 
+    parser.add_argument("--no-write-behind", action="store_true",
+                        help="Write the files on the acquisition thread",
+                        default=False)
+
+    parser.add_argument("--overlap-dark", action="store_true",
+                        help="Run dark measurements while the pan-tilt moves "
+                             "(pt_ref of a dark is the position reached for "
+                             "its geometry, flags of the next geometry can't "
+                             "refer to these darks)",
+                        default=False)
+
     args = parser.parse_args()
 
     basicConfig(level=log_levels[args.verbosity], format=log_fmt, datefmt=dt_fmt) # noqa
@@ -628,4 +806,6 @@ if __name__ == '__main__':
                       instrument_boot_timeout=args.timeout,
                       instrument_standalone=args.noyocto,
                       instrument_swir_tec=args.swir_tec,
-                      check_rain=args.check_rain)
+                      check_rain=args.check_rain,
+                      write_behind=not args.no_write_behind,
+                      overlap_dark=args.overlap_dark)
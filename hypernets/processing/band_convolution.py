@@ -0,0 +1,177 @@
+"""
+Convolution of spectra with the spectral response functions (SRF) of
+satellite sensors (Sentinel-2 MSI, Sentinel-3 OLCI, Landsat OLI...).
+
+SRF are read from local CSV files : a header line, the wavelength (nm) in
+the first column and the response of one band per column, e.g.
+
+    wavelength,B1,B2,B3
+    412.0,0.0012,0,0
+
+For a wavelength grid and a sensor, the SRF are turned once into a (bands x
+pixels) weight matrix (response times pixel width, normalised per band), so
+band values of a (spectra x pixels) stack are one matrix product.
+
+    python -m hypernets.processing.band_convolution -i quicklook.npz \\
+        -k reflectance -s srf/S2A_MSI.csv srf/S3A_OLCI.csv
+"""
+
+from argparse import ArgumentParser
+from functools import lru_cache
+from os import path
+
+import numpy as np
+
+from hypernets.abstract.name_convention import CC_RADIOMETERS
+from hypernets.reader.spectra import load_calibration_coefficients, \
+    calibrated_wavelengths
+
+from logging import info, warning
+
+
+# Fraction of the response of a band that the grid must cover
+MIN_COVERAGE = 0.99
+
+
+def load_srf(filename, delimiter=","):
+    """ Band names, wavelengths and (bands x wavelengths) responses. """
+    with open(filename) as fd:
+        header = fd.readline()
+        while header.startswith("#"):
+            header = fd.readline()
+        table = np.loadtxt(fd, delimiter=delimiter, comments="#", ndmin=2)
+
+    names = [name.strip() for name in header.split(delimiter)[1:]]
+    if len(names) != table.shape[1] - 1:
+        raise ValueError(f"{filename} : {len(names)} band names for "
+                         f"{table.shape[1] - 1} columns")
+
+    order = np.argsort(table[:, 0])
+    responses = np.nan_to_num(table[order, 1:].T).clip(min=0)
+    return names, table[order, 0], responses
+
+
+def pixel_widths(wavelengths):
+    """ Width of the pixels of a (monotonic) wavelength axis. """
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    edges = np.concatenate([[wavelengths[0]],
+                            (wavelengths[1:] + wavelengths[:-1]) / 2,
+                            [wavelengths[-1]]])
+    return np.abs(np.diff(edges))
+
+
+def band_weights(wavelengths, srf_wavelengths, responses,
+                 min_coverage=MIN_COVERAGE):
+    """
+    (bands x pixels) weights of the SRF on a wavelength axis. Bands whose
+    response isn't covered by the axis have NaN weights.
+    """
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+
+    weights = np.stack([np.interp(wavelengths, srf_wavelengths, response,
+                                  left=0., right=0.)
+                        for response in responses]) * pixel_widths(wavelengths)
+
+    totals = (responses * pixel_widths(srf_wavelengths)).sum(axis=1)
+    sums = weights.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coverage = sums / totals
+        weights /= sums[:, None]
+
+    weights[~(coverage >= min_coverage)] = np.nan
+    return weights
+
+
+@lru_cache(maxsize=32)
+def cached_weights(srf_file, mtime, wavelengths, min_coverage):
+    names, srf_wavelengths, responses = load_srf(srf_file)
+    weights = band_weights(wavelengths, srf_wavelengths, responses,
+                           min_coverage)
+    weights.flags.writeable = False
+
+    for name, band in zip(names, weights):
+        if np.isnan(band).any():
+            warning(f"{path.basename(srf_file)} {name} isn't covered by the "
+                    f"wavelengths, it will be NaN.")
+    return names, weights
+
+
+def sensor_weights(srf_file, wavelengths, min_coverage=MIN_COVERAGE):
+    """
+    Band names and weight matrix of a sensor for a wavelength axis, computed
+    once per (wavelength axis, SRF file).
+    """
+    return cached_weights(path.abspath(srf_file), path.getmtime(srf_file),
+                          tuple(float(w) for w in wavelengths), min_coverage)
+
+
+def convolve(spectra, weights):
+    """
+    Band values of (... x pixels) spectra. A band is NaN if a pixel it
+    weights is NaN, NaN elsewhere in the spectra don't propagate.
+    """
+    spectra = np.asarray(spectra, dtype=np.float64)
+    used = np.nan_to_num(weights) != 0
+
+    values = np.nan_to_num(spectra) @ np.nan_to_num(weights).T
+    values[(np.isnan(spectra) @ used.T) | np.isnan(weights).any(axis=1)] = \
+        np.nan
+    return values
+
+
+if __name__ == '__main__':
+    from logging import basicConfig, INFO
+
+    parser = ArgumentParser()
+    parser.add_argument("-i", "--input", type=str, required=True,
+                        help="Spectra (.npz with a 'wavelength' axis, e.g. "
+                             "from water_quicklook or resampling, or "
+                             "'<radiometer>/...' spectra with -C)")
+
+    parser.add_argument("-C", "--config-dump", type=str, default=None,
+                        help="Calibration coefficients for inputs without "
+                             "wavelength axis (dark_correction output)")
+
+    parser.add_argument("-k", "--key", type=str, nargs='+',
+                        default=["reflectance"],
+                        help="Spectra arrays of the input to convolve")
+
+    parser.add_argument("-s", "--srf", type=str, required=True, nargs='+',
+                        help="SRF files (.csv), one per sensor")
+
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Output file (default : <input>_bands.npz)")
+
+    args = parser.parse_args()
+
+    log_fmt = '[%(levelname)-7s %(asctime)s] (%(module)s) %(message)s'
+    basicConfig(level=INFO, format=log_fmt, datefmt='%Y-%m-%dT%H:%M:%S')
+
+    cc = None
+    if args.config_dump is not None:
+        cc = load_calibration_coefficients(args.config_dump)
+
+    output = dict()
+    with np.load(args.input) as spectra:
+        for key in args.key:
+            if "wavelength" in spectra.files:
+                wavelengths = spectra["wavelength"]
+            elif cc is not None:
+                radiometer = CC_RADIOMETERS[key.partition("/")[0]]
+                wavelengths = calibrated_wavelengths(cc, radiometer,
+                                                     spectra[key].shape[-1])
+            else:
+                parser.error(f"No wavelength axis for {key}, use -C")
+
+            for srf_file in args.srf:
+                sensor = path.splitext(path.basename(srf_file))[0]
+                names, weights = sensor_weights(srf_file, wavelengths)
+                output[f"{sensor}/band"] = np.array(names)
+                output[f"{sensor}/{key}"] = convolve(spectra[key], weights)
+                info(f"{key} : {len(names)} {sensor} bands.")
+
+    if args.output is None:
+        args.output = path.splitext(args.input)[0] + "_bands.npz"
+
+    np.savez_compressed(args.output, **output)
+    info(f"Band values saved to {args.output}")
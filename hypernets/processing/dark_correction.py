@@ -0,0 +1,219 @@
+"""
+Dark subtraction and scan averaging of the spectra of a sequence.
+
+The scans of every radiance or irradiance file are grouped by radiometer and
+integration time (a series). Each series is matched with a dark series of
+the same radiometer and integration time, preferably at the same geometry
+(pan, reference, tilt from the file names) and the nearest line of the
+protocol. Dark-corrected scans are normalised by the integration time
+(counts/ms), then mean, standard deviation and median are computed for all
+the series of a radiometer at once.
+
+With calibration coefficients (-C config.dump), the non-linearity of the VNIR
+counts is corrected (vnir_lin_coefs, see reader.spectra.linearity_correction)
+before the dark is subtracted. Without them, or for the SWIR (no coefficients),
+the counts are not linearity-corrected.
+
+    python -m hypernets.processing.dark_correction -s SEQ20210609T093031 \
+        -C config.dump
+"""
+
+from argparse import ArgumentParser
+from glob import glob
+from os import path
+
+import numpy as np
+
+from hypernets.abstract.name_convention import decode_names, ENTRANCES, \
+    RADIOMETERS, RADIOMETER_MASK, CC_RADIOMETERS
+from hypernets.reader.spectra import index_file, read_counts, \
+    linearity_correction, load_calibration_coefficients
+
+from logging import info, warning
+
+
+SERIES_FIELDS = ("line", "pan", "reference", "tilt", "entrance",
+                 "exposure_time", "timestamp")
+
+
+class Series(object):
+    """ Scans of one radiometer and integration time in a spectra file. """
+    def __init__(self, name, radiometer, headers, counts):
+        self.line = int(name["line"])
+        self.pan = int(name["pan"])
+        self.reference = int(name["reference"])
+        self.tilt = int(name["tilt"])
+        self.radiometer = radiometer
+        self.entrance = int(headers["spec_type"][0]) & 0x18
+        self.exposure_time = int(headers["exposure_time"][0])
+        self.timestamp = int(headers["timestamp"][0])
+        self.counts = counts
+
+    @property
+    def geometry(self):
+        return self.pan, self.reference, self.tilt
+
+
+def read_series(seq_path, verify=False):
+    """
+    Series of the radiance, irradiance and dark spectra files of a sequence.
+    """
+    filenames = sorted(glob(path.join(seq_path, "RADIOMETER", "*.spe")))
+    names = decode_names([path.basename(f) for f in filenames])
+    entrances = [ENTRANCES[e] for e in ("dark", "irr", "rad")]
+
+    series = []
+    for filename, name in zip(filenames, names):
+        if not name["valid"] or name["entrance"] not in entrances:
+            continue
+
+        buffer, offsets, headers = index_file(filename, verify)
+        for radiometer in CC_RADIOMETERS:
+            bits = RADIOMETERS[radiometer]
+            for exposure_time in np.unique(headers["exposure_time"]):
+                selection = \
+                    ((headers["spec_type"] & RADIOMETER_MASK) == bits) & \
+                    (headers["exposure_time"] == exposure_time)
+                if not selection.any():
+                    continue
+
+                pixel_count = int(headers["pixel_count"][selection][0])
+                counts = read_counts(buffer, offsets[selection], pixel_count)
+                series.append(Series(name, radiometer, headers[selection],
+                                     counts))
+    return series
+
+
+def stack(series, lin_coefs=None):
+    """
+    Counts of several series as (series x scans x pixels), NaN padded, and
+    linearity-corrected with lin_coefs.
+    """
+    nb_scans = max(len(s.counts) for s in series)
+    stacked = np.full((len(series), nb_scans, series[0].counts.shape[1]),
+                      np.nan, dtype=np.float32)
+    for n, s in enumerate(series):
+        stacked[n, :len(s.counts)] = s.counts
+    if lin_coefs is not None:
+        stacked = linearity_correction(stacked, lin_coefs).astype(np.float32)
+    return stacked
+
+
+def match_dark(light, darks):
+    """
+    Index of the dark series of 'darks' for 'light' : same integration
+    time, same geometry first, then nearest line. None if there is none.
+    """
+    candidates = [n for n, dark in enumerate(darks)
+                  if dark.exposure_time == light.exposure_time]
+    if not candidates:
+        return
+    return min(candidates, key=lambda n: (darks[n].geometry != light.geometry,
+                                          abs(darks[n].line - light.line)))
+
+
+def dark_correction(series, lin_coefs=None):
+    """
+    Dark-corrected, integration time normalised statistics of the light
+    series of one radiometer : dict of the SERIES_FIELDS, 'nb_scans',
+    'dark_line' and the 'mean', 'std' and 'median' spectra (series x pixels).
+    Counts are linearity-corrected with lin_coefs first (if not None).
+    """
+    darks = [s for s in series if s.entrance == ENTRANCES["dark"]]
+    lights = [s for s in series if s.entrance != ENTRANCES["dark"]]
+
+    matches = [match_dark(light, darks) for light in lights]
+    for light, match in zip(lights, matches):
+        if match is None:
+            warning(f"No dark at {light.exposure_time} ms for line "
+                    f"{light.line} ({light.radiometer}), skipped.")
+
+    lights = [light for light, m in zip(lights, matches) if m is not None]
+    matches = [m for m in matches if m is not None]
+    if not lights:
+        return
+
+    dark_means = np.nanmean(stack(darks, lin_coefs), axis=1)
+    exposure_times = np.array([s.exposure_time for s in lights],
+                              dtype=np.float32)
+
+    scans = (stack(lights, lin_coefs) - dark_means[matches][:, None, :]) / \
+        exposure_times[:, None, None]
+
+    result = {field: np.array([getattr(s, field) for s in lights])
+              for field in SERIES_FIELDS}
+    result["nb_scans"] = np.array([len(s.counts) for s in lights])
+    result["dark_line"] = np.array([darks[m].line for m in matches])
+    result["mean"] = np.nanmean(scans, axis=1)
+    result["std"] = np.nanstd(scans, axis=1)
+    result["median"] = np.nanmedian(scans, axis=1)
+    return result
+
+
+def process_sequence(seq_path, verify=False, cc=None):
+    """
+    dark_correction() of each radiometer of a sequence, VNIR counts
+    linearity-corrected if there are calibration coefficients (cc).
+    """
+    series = read_series(seq_path, verify)
+
+    results = dict()
+    for radiometer in CC_RADIOMETERS:
+        selection = [s for s in series if s.radiometer == radiometer]
+        if not selection:
+            continue
+
+        pixel_counts = {s.counts.shape[1] for s in selection}
+        if len(pixel_counts) != 1:
+            raise ValueError(f"Several {radiometer} pixel counts : "
+                             f"{pixel_counts}")
+
+        lin_coefs = None
+        if cc is not None and radiometer == "vnir":
+            lin_coefs = cc.vnir_lin_coefs
+
+        result = dark_correction(selection, lin_coefs)
+        if result is not None:
+            results[radiometer] = result
+            info(f"{radiometer} : {len(result['line'])} dark-corrected "
+                 f"series.")
+
+    return results
+
+
+if __name__ == '__main__':
+    from logging import basicConfig, INFO
+
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--sequence", type=str, required=True,
+                        help="Sequence directory (SEQ...)")
+
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Output file (.npz, default : "
+                             "<sequence>_dark_corrected.npz)")
+
+    parser.add_argument("-V", "--verify", action='store_true', default=False,
+                        help="Use only records with a valid CRC")
+
+    parser.add_argument("-C", "--config-dump", type=str, default=None,
+                        help="Calibration coefficients (config.dump) for the "
+                             "VNIR linearity correction")
+
+    args = parser.parse_args()
+
+    log_fmt = '[%(levelname)-7s %(asctime)s] (%(module)s) %(message)s'
+    basicConfig(level=INFO, format=log_fmt, datefmt='%Y-%m-%dT%H:%M:%S')
+
+    output = args.output
+    if output is None:
+        output = path.normpath(args.sequence) + "_dark_corrected.npz"
+
+    cc = None
+    if args.config_dump is not None:
+        cc = load_calibration_coefficients(args.config_dump)
+
+    results = process_sequence(args.sequence, args.verify, cc)
+    np.savez_compressed(output, **{f"{radiometer}/{key}": value
+                                   for radiometer, result in results.items()
+                                   for key, value in result.items()})
+    info(f"Saved to {output}")
@@ -0,0 +1,373 @@
+"""
+Per-site (time x wavelength) datacube of the spectra of one entrance and
+geometry, e.g. the sky radiance at tilt 140 or the dark of the VNIR.
+
+A cube is a directory with :
+
+    spectra.f4     float32 (time x pixels) rows, appended, read as a memmap
+    index.bin      one INDEX_DTYPE row per row of spectra.f4 (time index)
+    sequences.txt  names of the sequences already processed
+    axis.npz       wavelengths, pixel count, unit, selection and calibration
+                   state (linearity correction, hash of the wavelength
+                   coefficients) of the cube
+
+A row is the mean of a series (all the scans of a line of a sequence), not a
+single scan, its number of scans is in index.bin. Radiance and irradiance rows
+are the dark-corrected means of dark_correction.py (counts/ms, or calibrated
+with gains, VNIR linearity-corrected with -C) and dark rows the mean raw counts
+of the dark series. New sequences
+are found in the catalog, so the daily update only reads the .spe files of the
+sequences that aren't in sequences.txt yet, including the ones without
+spectra of the selection.
+
+The name of a sequence is added to sequences.txt once its rows are synced :
+rows of a sequence that isn't in sequences.txt (interrupted append) are
+dropped when the cube is opened.
+
+    python -m hypernets.processing.datacube -c catalog.db --site GHNA \\
+        -o cubes -r vnir -e rad -t 140 -C config.dump
+
+    cube = DataCube("cubes/GHNA/vnir_rad_t140")
+    cube.spectra[cube.index["datetime"] > np.datetime64("2025-01-01")]
+"""
+
+from argparse import ArgumentParser
+from contextlib import closing
+from os import path, makedirs, fsync
+
+import numpy as np
+
+from hypernets.abstract.name_convention import ENTRANCES, CC_RADIOMETERS
+from hypernets.archive.catalog import connect, query_files
+from hypernets.processing.dark_correction import process_sequence, \
+    read_series
+from hypernets.processing.resampling import array_hash
+from hypernets.reader.spectra import load_calibration_coefficients, \
+    calibrated_wavelengths
+
+from logging import info, warning
+
+
+INDEX_DTYPE = np.dtype([("datetime", 'datetime64[s]'), ("sequence", 'U32'),
+                        ("line", '<i4'), ("pan", '<i4'), ("tilt", '<i4'),
+                        ("exposure_time", '<i4'), ("nb_scans", '<i4')])
+
+GAINS = {"rad": "radiance", "irr": "irradiance"}
+
+
+def cube_name(radiometer, entrance, tilt=None, pan=None):
+    name = f"{radiometer}_{entrance}"
+    if tilt is not None:
+        name += f"_t{tilt}"
+    if pan is not None:
+        name += f"_p{pan}"
+    return name
+
+
+class DataCube(object):
+    """
+    Memory-mapped (time x wavelength) cube of a directory, created on the
+    first append.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.axis = dict()
+        self.processed = set()
+
+        axis_file = path.join(directory, "axis.npz")
+        if path.exists(axis_file):
+            with np.load(axis_file) as axis:
+                self.axis = {key: axis[key] for key in axis.files}
+
+        sequences_file = path.join(directory, "sequences.txt")
+        if path.exists(sequences_file):
+            with open(sequences_file) as fd:
+                self.processed = {line.strip() for line in fd if line.strip()}
+
+        self.repair()
+
+    def filename(self, name):
+        return path.join(self.directory, name)
+
+    @property
+    def pixel_count(self):
+        return int(self.axis["pixel_count"]) if self.axis else None
+
+    def __len__(self):
+        if not path.exists(self.filename("index.bin")):
+            return 0
+        return path.getsize(self.filename("index.bin")) // INDEX_DTYPE.itemsize
+
+    def repair(self):
+        """
+        Truncates the spectra and the index to the rows written in both of
+        them, and of sequences marked as processed (interrupted append).
+        """
+        if not self.axis or not path.exists(self.filename("spectra.f4")):
+            return
+
+        row_size = 4 * self.pixel_count
+        rows = min(len(self), path.getsize(self.filename("spectra.f4")) //
+                   row_size)
+
+        # Appends are in order : unrecorded sequences are at the end
+        if rows:
+            sequences = np.memmap(self.filename("index.bin"),
+                                  dtype=INDEX_DTYPE, mode='r',
+                                  shape=(rows, ))["sequence"]
+            recorded = np.flatnonzero(np.isin(sequences,
+                                              list(self.processed)))
+            rows = int(recorded[-1]) + 1 if len(recorded) else 0
+            del sequences
+        for name, size in (("spectra.f4", row_size),
+                           ("index.bin", INDEX_DTYPE.itemsize)):
+            if path.getsize(self.filename(name)) != rows * size:
+                warning(f"{self.filename(name)} truncated to {rows} rows.")
+                with open(self.filename(name), "r+b") as fd:
+                    fd.truncate(rows * size)
+
+    @property
+    def index(self):
+        if not len(self):
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.memmap(self.filename("index.bin"), dtype=INDEX_DTYPE,
+                         mode='r')
+
+    @property
+    def spectra(self):
+        if not len(self):
+            return np.zeros((0, self.pixel_count or 0), dtype=np.float32)
+        return np.memmap(self.filename("spectra.f4"), dtype=np.float32,
+                         mode='r', shape=(len(self), self.pixel_count))
+
+    @property
+    def wavelength(self):
+        return self.axis.get("wavelength")
+
+    def create(self, wavelength, unit, selection, linearity=False,
+               calibration=""):
+        makedirs(self.directory, exist_ok=True)
+        self.axis = {"wavelength": np.asarray(wavelength),
+                     "pixel_count": np.array(len(wavelength)),
+                     "unit": np.array(unit), "selection": np.array(selection),
+                     "linearity": np.array(linearity),
+                     "calibration": np.array(calibration)}
+        np.savez(self.filename("axis.npz"), **self.axis)
+
+    def mark_processed(self, sequence):
+        makedirs(self.directory, exist_ok=True)
+        with open(self.filename("sequences.txt"), "a") as fd:
+            fd.write(sequence + "\n")
+            fd.flush()
+            fsync(fd.fileno())
+        self.processed.add(sequence)
+
+    def append(self, sequence, rows, spectra):
+        """
+        Appends the spectra of a sequence (may be empty) and marks it as
+        processed. Spectra and index are synced before the sequence name.
+        """
+        spectra = np.asarray(spectra, dtype=np.float32).reshape(
+            -1, self.pixel_count)
+        rows = np.asarray(rows, dtype=INDEX_DTYPE)
+        if len(rows) != len(spectra):
+            raise ValueError(f"{len(rows)} index rows for {len(spectra)} "
+                             f"spectra")
+
+        for name, data in (("spectra.f4", spectra), ("index.bin", rows)):
+            with open(self.filename(name), "ab") as fd:
+                fd.write(data.tobytes())
+                fd.flush()
+                fsync(fd.fileno())
+
+        self.mark_processed(sequence)
+
+
+def sequence_spectra(seq_path, radiometer, entrance, lines, gains=None,
+                     cc=None):
+    """
+    Spectra (counts/ms, calibrated with gains) of a radiometer at some lines
+    of a sequence, with their line, pan, tilt, integration time and number
+    of scans. VNIR spectra are linearity-corrected with cc. Dark spectra are
+    the mean raw counts of the dark series.
+    """
+    if entrance == "dark":
+        series = [s for s in read_series(seq_path)
+                  if s.radiometer == radiometer and s.line in lines and
+                  s.entrance == ENTRANCES["dark"]]
+        if not series:
+            return
+        fields = {field: np.array([getattr(s, field) for s in series])
+                  for field in ("line", "pan", "tilt", "exposure_time")}
+        fields["nb_scans"] = np.array([len(s.counts) for s in series])
+        return fields, np.stack([s.counts.mean(axis=0) for s in series])
+
+    result = process_sequence(seq_path, cc=cc).get(radiometer)
+    if result is None:
+        return
+
+    selection = np.isin(result["line"], list(lines)) & \
+        (result["entrance"] == ENTRANCES[entrance])
+    if not selection.any():
+        return
+
+    fields = {field: result[field][selection]
+              for field in ("line", "pan", "tilt", "exposure_time",
+                            "nb_scans")}
+    spectra = result["mean"][selection]
+    if gains is not None:
+        spectra = spectra * gains[f"{radiometer}_{GAINS[entrance]}"]
+    return fields, spectra
+
+
+def catalog_lines(connection, radiometer, entrance, tilt=None, pan=None,
+                  site_name=None, start=None, end=None):
+    """
+    Sequences of the catalog with spectra files of a selection :
+    {sequence path: {line: file datetime}}.
+    """
+    rows = query_files(connection, start, end, radiometer, entrance, pan,
+                       tilt, site_name=site_name, extension=".spe")
+    sequences = dict()
+    for row in rows:
+        seq_path = path.dirname(path.dirname(row["file_path"]))
+        sequences.setdefault(seq_path, dict())[row["line"]] = row["datetime"]
+    return dict(sorted(sequences.items()))
+
+
+def update_cube(cube, sequences, radiometer, entrance, cc=None, gains=None):
+    """
+    Appends the spectra of the sequences ({sequence path: {line: datetime}},
+    see catalog_lines()) that aren't in the cube yet. Returns the number of
+    new spectra.
+    """
+    unit = "counts" if entrance == "dark" else \
+        "calibrated" if gains is not None else "counts/ms"
+    linearity = cc is not None and radiometer == "vnir" and \
+        entrance != "dark" and float(cc.vnir_lin_coefs[0]) != 0
+
+    def wavelengths(pixel_count):
+        if cc is None:
+            return np.arange(pixel_count)
+        return calibrated_wavelengths(cc, CC_RADIOMETERS[radiometer],
+                                      pixel_count)
+
+    def calibration(pixel_count):
+        return "" if cc is None else array_hash(wavelengths(pixel_count))
+
+    count = 0
+    for seq_path, lines in sequences.items():
+        name = path.basename(seq_path)
+        if name in cube.processed:
+            continue
+
+        try:
+            spectra = sequence_spectra(seq_path, radiometer, entrance, lines,
+                                       gains, cc)
+        except (OSError, ValueError) as e:
+            warning(f"{name} : {e}, skipped.")
+            continue
+
+        if spectra is None:
+            warning(f"{name} : no {radiometer} {entrance} spectra.")
+            cube.mark_processed(name)
+            continue
+
+        fields, values = spectra
+        if not cube.axis:
+            pixel_count = values.shape[1]
+            cube.create(wavelengths(pixel_count), unit,
+                        f"{radiometer}_{entrance}", linearity,
+                        calibration(pixel_count))
+
+        if str(cube.axis["unit"]) != unit:
+            raise ValueError(f"{cube.directory} is in {cube.axis['unit']}, "
+                             f"not {unit}")
+
+        if bool(cube.axis.get("linearity", False)) != linearity:
+            state = "not " if linearity else ""
+            raise ValueError(f"{cube.directory} is {state}linearity-"
+                             f"corrected, unlike this update")
+
+        if str(cube.axis.get("calibration", "")) != \
+                calibration(cube.pixel_count):
+            raise ValueError(f"{cube.directory} has other wavelength "
+                             f"coefficients than this update")
+
+        if values.shape[1] != cube.pixel_count:
+            warning(f"{name} : {values.shape[1]} pixels instead of "
+                    f"{cube.pixel_count}, skipped.")
+            cube.mark_processed(name)
+            continue
+
+        rows = np.zeros(len(values), dtype=INDEX_DTYPE)
+        rows["datetime"] = [lines.get(int(line)) or "NaT"
+                            for line in fields["line"]]
+        rows["sequence"] = name
+        for field in ("line", "pan", "tilt", "exposure_time", "nb_scans"):
+            rows[field] = fields[field]
+
+        cube.append(name, rows, values)
+        count += len(values)
+
+    return count
+
+
+if __name__ == '__main__':
+    from logging import basicConfig, INFO
+
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--catalog", type=str, default="catalog.db",
+                        help="SQLite catalog (see hypernets.archive.catalog)")
+
+    parser.add_argument("--site", type=str, required=True)
+
+    parser.add_argument("-o", "--output", type=str, default="cubes",
+                        help="Directory of the cubes (<site>/<selection>)")
+
+    parser.add_argument("-r", "--radiometer", type=str, default="vnir",
+                        choices=list(CC_RADIOMETERS))
+
+    parser.add_argument("-e", "--entrance", type=str, default="rad",
+                        choices=("rad", "irr", "dark"))
+
+    parser.add_argument("-t", "--tilt", type=int, default=None)
+    parser.add_argument("-p", "--pan", type=int, default=None)
+
+    parser.add_argument("--start", type=str, default=None,
+                        help="First date (ISO, included)")
+    parser.add_argument("--end", type=str, default=None,
+                        help="Last date (ISO, excluded)")
+
+    parser.add_argument("-C", "--config-dump", type=str, default=None,
+                        help="Calibration coefficients (config.dump) for "
+                             "the wavelengths and the VNIR linearity")
+
+    parser.add_argument("-g", "--gains", type=str, default=None,
+                        help="Radiometric gains (.npz)")
+
+    args = parser.parse_args()
+
+    log_fmt = '[%(levelname)-7s %(asctime)s] (%(module)s) %(message)s'
+    basicConfig(level=INFO, format=log_fmt, datefmt='%Y-%m-%dT%H:%M:%S')
+
+    cc = None
+    if args.config_dump is not None:
+        cc = load_calibration_coefficients(args.config_dump)
+
+    gains = None
+    if args.gains is not None:
+        gains = np.load(args.gains)
+
+    with closing(connect(args.catalog)) as connection:
+        sequences = catalog_lines(connection, args.radiometer, args.entrance,
+                                  args.tilt, args.pan, args.site, args.start,
+                                  args.end)
+
+    cube = DataCube(path.join(args.output, args.site,
+                              cube_name(args.radiometer, args.entrance,
+                                        args.tilt, args.pan)))
+
+    count = update_cube(cube, sequences, args.radiometer, args.entrance, cc,
+                        gains)
+    info(f"{count} spectra appended, {len(cube)} in {cube.directory}")
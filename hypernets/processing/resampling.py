@@ -0,0 +1,215 @@
+"""
+Resampling of spectra on a common wavelength grid.
+
+The linear interpolation from the wavelength axis of a radiometer to a grid
+is a sparse matrix with (at most) two weights per grid wavelength. It is
+stored as the column indices and weights of its rows, built once per
+(instrument serial, radiometer, calibration, grid) and cached in memory and
+on disk (~/.cache/hypernets/resampling). Applying it to a (spectra x pixels)
+stack is a single gather and weighted sum.
+
+    grid = np.arange(400, 1700, 1.)
+    matrix = resampling_matrix(serial, "vnir", wavelengths, grid)
+    resampled = resample(spectra, matrix)
+
+Grid wavelengths outside of the axis of the radiometer are NaN. VNIR and
+SWIR series of the same protocol line are stitched as one spectrum.
+"""
+
+from argparse import ArgumentParser
+from functools import lru_cache
+from hashlib import sha1
+from os import path, makedirs, replace
+
+import numpy as np
+
+from hypernets.abstract.name_convention import CC_RADIOMETERS
+from hypernets.reader.spectra import load_config_dump, calibrated_wavelengths
+
+from logging import debug, info, warning
+
+
+CACHE_DIR = path.join(path.expanduser("~"), ".cache", "hypernets",
+                      "resampling")
+
+# Default VNIR to SWIR crossover of stitched spectra (nm)
+CROSSOVER = 1000.
+
+
+def array_hash(array):
+    return sha1(np.ascontiguousarray(array, dtype=np.float64).tobytes())\
+        .hexdigest()[:16]
+
+
+def interpolation_matrix(wavelengths, grid):
+    """
+    Linear interpolation matrix from 'wavelengths' (any order) to 'grid' :
+    (grid x 2) column indices and weights. Rows of grid wavelengths out of
+    range have NaN weights.
+    """
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    grid = np.asarray(grid, dtype=np.float64)
+
+    order = np.argsort(wavelengths)
+    sorted_wavelengths = wavelengths[order]
+
+    right = np.clip(np.searchsorted(sorted_wavelengths, grid), 1,
+                    len(wavelengths) - 1)
+    left = right - 1
+
+    x0, x1 = sorted_wavelengths[left], sorted_wavelengths[right]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w1 = np.where(x1 > x0, (grid - x0) / (x1 - x0), 0.)
+
+    weights = np.stack([1. - w1, w1], axis=1)
+    outside = (grid < sorted_wavelengths[0]) | (grid > sorted_wavelengths[-1])
+    weights[outside] = np.nan
+
+    indices = np.stack([order[left], order[right]], axis=1)
+    return indices.astype(np.int32), weights.astype(np.float32)
+
+
+def cache_filename(serial, radiometer, wavelengths, grid, cache_dir=CACHE_DIR):
+    return path.join(cache_dir, f"{serial}_{radiometer}_"
+                                f"{array_hash(wavelengths)}_"
+                                f"{array_hash(grid)}.npz")
+
+
+@lru_cache(maxsize=32)
+def cached_matrix(serial, radiometer, wavelengths, grid, cache_dir):
+    """ resampling_matrix() with hashable (tuple) arguments. """
+    filename = cache_filename(serial, radiometer, wavelengths, grid,
+                              cache_dir)
+    try:
+        with np.load(filename) as cached:
+            matrix = cached["indices"], cached["weights"]
+        debug(f"Resampling matrix loaded from {filename}")
+
+    except (OSError, KeyError, ValueError):
+        matrix = interpolation_matrix(wavelengths, grid)
+
+        try:
+            makedirs(cache_dir, exist_ok=True)
+            tmp_filename = filename + ".tmp.npz"
+            np.savez(tmp_filename, indices=matrix[0], weights=matrix[1])
+            replace(tmp_filename, filename)
+            debug(f"Resampling matrix saved to {filename}")
+        except OSError as e:
+            warning(f"Can't cache the resampling matrix : {e}")
+
+    # Shared by every caller
+    for array in matrix:
+        array.flags.writeable = False
+    return matrix
+
+
+def resampling_matrix(serial, radiometer, wavelengths, grid,
+                      cache_dir=CACHE_DIR):
+    """
+    Interpolation matrix of a radiometer of an instrument to a grid, from
+    the memory or disk cache if it was already built.
+    """
+    return cached_matrix(str(serial), radiometer,
+                         tuple(float(w) for w in wavelengths),
+                         tuple(float(g) for g in grid), cache_dir)
+
+
+def resample(spectra, matrix):
+    """ Resampling of (... x pixels) spectra with an interpolation matrix. """
+    indices, weights = matrix
+    spectra = np.asarray(spectra, dtype=np.float32)
+    return (spectra[..., indices] * weights).sum(axis=-1)
+
+
+def stitch(vnir, swir, grid, crossover=CROSSOVER):
+    """
+    VNIR and SWIR spectra resampled on the same grid as one spectrum : VNIR
+    below the crossover wavelength, SWIR above, the other one where a
+    radiometer doesn't cover the grid.
+    """
+    grid = np.asarray(grid)
+    first, second = np.where(grid < crossover, vnir, swir), \
+        np.where(grid < crossover, swir, vnir)
+    return np.where(np.isnan(first), second, first)
+
+
+def pair_series(vnir_lines, swir_lines):
+    """
+    Indices of the VNIR and SWIR series (dark_correction rows) of the same
+    protocol lines, for the lines with one series of each radiometer.
+    """
+    vnir_lines, swir_lines = np.asarray(vnir_lines), np.asarray(swir_lines)
+    lines = [line for line in np.intersect1d(vnir_lines, swir_lines)
+             if np.sum(vnir_lines == line) == 1 and
+             np.sum(swir_lines == line) == 1]
+    return np.array([np.flatnonzero(vnir_lines == line)[0] for line in lines],
+                    dtype=np.int64), \
+        np.array([np.flatnonzero(swir_lines == line)[0] for line in lines],
+                 dtype=np.int64)
+
+
+if __name__ == '__main__':
+    from logging import basicConfig, INFO
+
+    parser = ArgumentParser()
+    parser.add_argument("-i", "--input", type=str, required=True,
+                        help="Dark-corrected spectra (.npz of "
+                             "hypernets.processing.dark_correction)")
+
+    parser.add_argument("-C", "--config-dump", type=str,
+                        default="config.dump",
+                        help="Serials and calibration coefficients")
+
+    parser.add_argument("-g", "--grid", type=float, nargs=3,
+                        default=[400., 1700., 1.],
+                        metavar=("START", "STOP", "STEP"),
+                        help="Wavelength grid (nm)")
+
+    parser.add_argument("-x", "--crossover", type=float, default=CROSSOVER,
+                        help="VNIR to SWIR crossover wavelength (nm)")
+
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Output file (default : <input>_resampled.npz)")
+
+    args = parser.parse_args()
+
+    log_fmt = '[%(levelname)-7s %(asctime)s] (%(module)s) %(message)s'
+    basicConfig(level=INFO, format=log_fmt, datefmt='%Y-%m-%dT%H:%M:%S')
+
+    serials, cc, _ = load_config_dump(args.config_dump)
+    radiometer_serials = {"vnir": serials[1], "swir": serials[2]}
+
+    grid = np.arange(*args.grid)
+    output = {"wavelength": grid}
+
+    with np.load(args.input) as spectra:
+        for key in spectra.files:
+            radiometer, _, field = key.partition("/")
+            if field not in ("mean", "std", "median"):
+                output[key] = spectra[key]
+                continue
+
+            wavelengths = calibrated_wavelengths(
+                cc, CC_RADIOMETERS[radiometer], spectra[key].shape[-1])
+            matrix = resampling_matrix(radiometer_serials[radiometer],
+                                       radiometer, wavelengths, grid)
+            output[key] = resample(spectra[key], matrix)
+
+    if "vnir/line" in output and "swir/line" in output:
+        vnir_index, swir_index = pair_series(output["vnir/line"],
+                                             output["swir/line"])
+        if len(vnir_index):
+            output["stitched/line"] = output["vnir/line"][vnir_index]
+            for field in ("mean", "std", "median"):
+                output[f"stitched/{field}"] = stitch(
+                    output[f"vnir/{field}"][vnir_index],
+                    output[f"swir/{field}"][swir_index], grid, args.crossover)
+        else:
+            warning("No VNIR and SWIR series of the same line, nothing "
+                    "stitched.")
+
+    if args.output is None:
+        args.output = path.splitext(args.input)[0] + "_resampled.npz"
+
+    np.savez_compressed(args.output, **output)
+    info(f"Resampled spectra saved to {args.output}")
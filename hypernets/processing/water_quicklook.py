@@ -0,0 +1,210 @@
+"""
+Water-leaving reflectance quicklook of the standard water protocol.
+
+For each sequence, the dark-corrected series (see dark_correction.py) at the
+Ed, Ld and Lu positions (irradiance at tilt 180, radiance at tilts 140 and
+40) are averaged. The spectra of all the sequences are then stacked and the
+first-guess reflectance is computed for the whole season at once :
+
+    rho_w = pi * (Lu - rho_sky * Ld) / Ed
+
+Without radiometric gains (-g, .npz with '<radiometer>_radiance' and
+'<radiometer>_irradiance' arrays) Ed, Ld and Lu stay in counts/ms and the
+reflectance is only relative. VNIR counts are only linearity-corrected with
+calibration coefficients (-C).
+
+    python -m hypernets.processing.water_quicklook -c catalog.db \\
+        --start 2025-05-01 --end 2025-09-01 -C config.dump -p
+"""
+
+from argparse import ArgumentParser
+from contextlib import closing
+from datetime import datetime
+from os import path
+
+import numpy as np
+
+from hypernets.abstract.name_convention import ENTRANCES, CC_RADIOMETERS
+from hypernets.archive.catalog import connect, query_files, sequence_datetime
+from hypernets.processing.dark_correction import process_sequence
+from hypernets.reader.spectra import load_calibration_coefficients, \
+    calibrated_wavelengths
+
+from logging import info, warning
+
+
+# Entrance and tilt of the Ed, Ld and Lu blocks of the water protocol
+WATER_POSITIONS = {"ed": ("irr", 180), "ld": ("rad", 140), "lu": ("rad", 40)}
+
+# Sea surface reflectance factor for the sky glint
+RHO_SKY = 0.028
+
+
+def sequence_quicklook(seq_path, radiometer="vnir", verify=False, cc=None):
+    """
+    Mean dark-corrected Ed, Ld and Lu (counts/ms) of a water sequence, None
+    if one of them is missing.
+    """
+    result = process_sequence(seq_path, verify, cc).get(radiometer)
+    if result is None:
+        warning(f"{seq_path} : no {radiometer} spectra.")
+        return
+
+    spectra = dict()
+    for key, (entrance, tilt) in WATER_POSITIONS.items():
+        selection = (result["entrance"] == ENTRANCES[entrance]) & \
+            (result["tilt"] == tilt)
+        if not selection.any():
+            warning(f"{seq_path} : no {key} ({entrance} at tilt {tilt}).")
+            return
+        spectra[key] = result["mean"][selection].mean(axis=0)
+
+    return spectra
+
+
+def water_reflectance(ed, ld, lu, rho_sky=RHO_SKY):
+    """ First-guess reflectance of (spectra x wavelengths) stacks. """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.pi * (lu - rho_sky * ld) / ed
+
+
+def water_sequences(connection, start=None, end=None, site_name=None):
+    """ Sequences of the catalog with a water radiance (Lu) file. """
+    entrance, tilt = WATER_POSITIONS["lu"]
+    rows = query_files(connection, start, end, entrance=entrance, tilt=tilt,
+                       site_name=site_name, extension=".spe")
+    return sorted({path.dirname(path.dirname(row["file_path"]))
+                   for row in rows})
+
+
+def season_quicklook(sequences, radiometer="vnir", cc=None, gains=None,
+                     rho_sky=RHO_SKY, verify=False):
+    """
+    Stacked Ed, Ld, Lu and reflectance (sequences x wavelengths) of water
+    sequences, with their names, datetimes and the wavelength axis.
+    """
+    names, spectra = [], []
+    for seq_path in sequences:
+        quicklook = sequence_quicklook(seq_path, radiometer, verify, cc)
+        if quicklook is not None:
+            names.append(path.basename(seq_path))
+            spectra.append(quicklook)
+
+    if not spectra:
+        return
+
+    pixel_counts = {len(s["ed"]) for s in spectra}
+    if len(pixel_counts) != 1:
+        raise ValueError(f"Several {radiometer} pixel counts : "
+                         f"{pixel_counts}")
+    pixel_count = pixel_counts.pop()
+
+    product = {key: np.stack([s[key] for s in spectra])
+               for key in WATER_POSITIONS}
+
+    if gains is not None:
+        product["ed"] *= gains[f"{radiometer}_irradiance"]
+        product["ld"] *= gains[f"{radiometer}_radiance"]
+        product["lu"] *= gains[f"{radiometer}_radiance"]
+
+    product["reflectance"] = water_reflectance(product["ed"], product["ld"],
+                                               product["lu"], rho_sky)
+
+    if cc is not None:
+        product["wavelength"] = calibrated_wavelengths(
+            cc, CC_RADIOMETERS[radiometer], pixel_count)
+    else:
+        product["wavelength"] = np.arange(pixel_count)
+
+    product["sequence"] = np.array(names)
+    product["datetime"] = np.array([sequence_datetime(n) for n in names],
+                                   dtype='datetime64[s]')
+    product["calibrated"] = np.array(gains is not None)
+
+    info(f"Quicklook of {len(names)} sequences ({radiometer}).")
+    return product
+
+
+def plot_quicklook(product, filename):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    figure, axes = plt.subplots(figsize=(10, 6))
+    for name, reflectance in zip(product["sequence"], product["reflectance"]):
+        axes.plot(product["wavelength"], reflectance, label=name, lw=.8)
+
+    axes.set_xlabel("Wavelength (nm)")
+    axes.set_ylabel("Reflectance" if product["calibrated"]
+                    else "Reflectance (relative, uncalibrated)")
+    if len(product["sequence"]) <= 10:
+        axes.legend(fontsize="small")
+
+    figure.savefig(filename, dpi=100)
+    plt.close(figure)
+    info(f"Plot saved to {filename}")
+
+
+if __name__ == '__main__':
+    from logging import basicConfig, INFO
+
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--catalog", type=str, default="catalog.db",
+                        help="SQLite catalog (see hypernets.archive.catalog)")
+
+    parser.add_argument("-s", "--sequence", type=str, default=None,
+                        nargs='+', help="Sequence directories (instead of "
+                                        "the catalog)")
+
+    parser.add_argument("--start", type=str, default=None,
+                        help="First date (ISO, included)")
+    parser.add_argument("--end", type=str, default=None,
+                        help="Last date (ISO, excluded)")
+    parser.add_argument("--site", type=str, default=None)
+
+    parser.add_argument("-r", "--radiometer", type=str, default="vnir",
+                        choices=list(CC_RADIOMETERS))
+
+    parser.add_argument("-C", "--config-dump", type=str, default=None,
+                        help="Calibration coefficients (config.dump) for "
+                             "the wavelengths and the VNIR linearity")
+
+    parser.add_argument("-g", "--gains", type=str, default=None,
+                        help="Radiometric gains (.npz)")
+
+    parser.add_argument("-o", "--output", type=str,
+                        default=f"quicklook_{datetime.now():%Y%m%dT%H%M%S}"
+                                ".npz", help="Output file (.npz)")
+
+    parser.add_argument("-p", "--plot", action='store_true', default=False,
+                        help="Save a plot of the reflectances (.png)")
+
+    args = parser.parse_args()
+
+    log_fmt = '[%(levelname)-7s %(asctime)s] (%(module)s) %(message)s'
+    basicConfig(level=INFO, format=log_fmt, datefmt='%Y-%m-%dT%H:%M:%S')
+
+    sequences = args.sequence
+    if sequences is None:
+        with closing(connect(args.catalog)) as connection:
+            sequences = water_sequences(connection, args.start, args.end,
+                                        args.site)
+
+    cc = None
+    if args.config_dump is not None:
+        cc = load_calibration_coefficients(args.config_dump)
+
+    gains = None
+    if args.gains is not None:
+        gains = np.load(args.gains)
+
+    product = season_quicklook(sequences, args.radiometer, cc, gains)
+    if product is None:
+        warning("No water sequence found.")
+        exit(1)
+
+    np.savez_compressed(args.output, **product)
+    info(f"Quicklook saved to {args.output}")
+
+    if args.plot:
+        plot_quicklook(product, path.splitext(args.output)[0] + ".png")
@@ -1,6 +1,9 @@
 
 from argparse import ArgumentParser
-from hypernets.reader.spectra import Spectra, show_interactive_plots
+from sys import stdout
+from hypernets.reader.spectra import Spectra, show_interactive_plots, \
+    scan_headers, write_headers_csv
+from hypernets.reader.verify import verify_spectra
 
 import matplotlib.pyplot as plt
 
@@ -10,22 +13,76 @@ if __name__ == '__main__':
     parser = ArgumentParser()
 
     parser.add_argument("-f", "--filename", type=str, required=True,
-                        help="Select Spectra file")
+                        nargs='+',
+                        help="Select Spectra file(s), '-' for stdin with "
+                             "--headers-only")
 
     parser.add_argument("-n", "--no-display", required=False, default=False,
                         action='store_true',
                         help="Don't Display Interactive Plots")
 
-    from logging import basicConfig, DEBUG
-    basicConfig(level=DEBUG)
+    parser.add_argument("-l", "--lazy", required=False, default=False,
+                        action='store_true',
+                        help="Memory-map the file and decode spectra on access")
+
+    parser.add_argument("-H", "--headers-only", required=False, default=False,
+                        action='store_true',
+                        help="Only scan the headers and output a table")
+
+    parser.add_argument("-V", "--verify", required=False, default=False,
+                        action='store_true',
+                        help="Check the CRC of the records, skip corrupted "
+                             "ones (with --headers-only : only report)")
+
+    parser.add_argument("-o", "--output", type=str, required=False,
+                        default=None,
+                        help="Output of the header table (.csv or .npy), "
+                             "default is CSV on stdout")
+
+    from logging import basicConfig, DEBUG, WARNING
 
     args = parser.parse_args()
 
+    if args.headers_only and args.verify:
+        basicConfig(level=WARNING)
+        print("filename,records,good,bad_crc,unreadable_regions")
+        nb_bad = 0
+        for filename in args.filename:
+            with open(filename, 'rb') as fd:
+                offsets, crc_ok, skipped = verify_spectra(fd.read())
+            nb_bad += (~crc_ok).sum() + skipped
+            print(f"{filename},{len(offsets)},{crc_ok.sum()},"
+                  f"{(~crc_ok).sum()},{skipped}")
+        exit(1 if nb_bad else 0)
+
+    if args.headers_only:
+        basicConfig(level=WARNING)
+        table = scan_headers(args.filename)
+
+        if args.output is None:
+            write_headers_csv(table, stdout)
+        elif args.output.endswith(".npy"):
+            import numpy as np
+            np.save(args.output, table)
+        else:
+            with open(args.output, 'w') as fd:
+                write_headers_csv(table, fd)
+        exit(0)
+
+    basicConfig(level=DEBUG)
+
+    if len(args.filename) != 1:
+        parser.error("Only one file can be displayed, use --headers-only "
+                     "for several files.")
+
+    args.filename = args.filename[0]
+
     if args.no_display is False:
         figure, axes = plt.subplots()
         plt.subplots_adjust(bottom=0.2)
-        spectra = Spectra(args.filename, figure=figure, axes=axes)
+        spectra = Spectra(args.filename, figure=figure, axes=axes,
+                          lazy=args.lazy, verify=args.verify)
         show_interactive_plots(spectra)
 
     else:
-        spectra = Spectra(args.filename)
+        spectra = Spectra(args.filename, lazy=args.lazy, verify=args.verify)
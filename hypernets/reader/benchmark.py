@@ -0,0 +1,83 @@
+"""
+Decode rate of Spectrum records with the INFO header log enabled and
+disabled, on the bundled data_spectra_examples files.
+
+python -m hypernets.reader.benchmark [-r 200]
+"""
+
+from argparse import ArgumentParser
+from importlib import resources
+from time import perf_counter
+
+from hypernets import resources as hypernets_resources
+from hypernets.reader.spectra import index_spectra
+from hypernets.reader.spectrum import Spectrum
+
+from logging import getLogger, basicConfig, NullHandler, INFO, WARNING, \
+    warning
+
+
+def list_examples(directory=None):
+    if directory is None:
+        directory = resources.files(hypernets_resources)\
+            .joinpath("data_spectra_examples")
+
+    for entry in directory.iterdir():
+        if entry.is_dir():
+            yield from list_examples(entry)
+        elif entry.name.endswith((".spe", ".bin")):
+            yield entry
+
+
+def load_examples():
+    buffers = []
+    for example in list_examples():
+        buffer = example.read_bytes()
+        offsets = index_spectra(buffer)
+        try:
+            for offset in offsets:
+                Spectrum(buffer, int(offset))
+        except ValueError as e:
+            warning(f"Skipping {example.name} : {e}")
+            continue
+
+        buffers.append((buffer, offsets))
+    return buffers
+
+
+def decode_rate(buffers, repeat):
+    n = 0
+    start = perf_counter()
+    for _ in range(repeat):
+        for buffer, offsets in buffers:
+            for offset in offsets:
+                Spectrum(buffer, int(offset))
+                n += 1
+    return n / (perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("-r", "--repeat", type=int, default=200,
+                        help="Number of passes over the example files")
+    args = parser.parse_args()
+
+    basicConfig(level=WARNING)
+    buffers = load_examples()
+
+    # Records are formatted but not printed
+    logger = getLogger()
+    handlers, logger.handlers = logger.handlers, [NullHandler()]
+
+    results = dict()
+    for level in (INFO, WARNING):
+        logger.setLevel(level)
+        results[level] = decode_rate(buffers, args.repeat)
+
+    logger.handlers = handlers
+
+    print(f"{sum(len(offsets) for _, offsets in buffers)} records "
+          f"from {len(buffers)} example files, {args.repeat} passes :")
+    print(f" - log level INFO    : {results[INFO]:10.0f} spectra/s")
+    print(f" - log level WARNING : {results[WARNING]:10.0f} spectra/s "
+          f"(x{results[WARNING] / results[INFO]:.1f})")
@@ -0,0 +1,131 @@
+"""
+Sidecar offset index of a spectra file ('<file>.spe.idx').
+
+It is written when the spectra are saved (see HypstarHandler.take_spectra)
+and holds one INDEX_DTYPE row per record (offset and header), so that seeking
+to a record, filtering them by type or reading their headers needs no scan of
+the spectra file :
+
+    index = read_index("01_003_0090_2_0180_128_08_0000_03_0000.spe")
+    irradiance = index[(index["spec_type"] & 0x18) == 0x08]
+"""
+
+from os import path, fsync
+
+import numpy as np
+
+from hypernets.reader.spectrum import HEADER_DTYPE
+
+from logging import debug, warning
+
+
+INDEX_SUFFIX = ".idx"
+
+INDEX_DTYPE = np.dtype([("offset", '<u8')] + HEADER_DTYPE.descr)
+
+
+def index_filename(path_to_file):
+    return path_to_file + INDEX_SUFFIX
+
+
+def make_index(buffer, offsets):
+    """
+    Index rows of the records of 'buffer' starting at 'offsets'.
+    """
+    headers = np.array([np.frombuffer(buffer, dtype=HEADER_DTYPE, count=1,
+                                      offset=int(offset))[0]
+                        for offset in offsets], dtype=HEADER_DTYPE)
+
+    index = np.empty(len(offsets), dtype=INDEX_DTYPE)
+    index["offset"] = offsets
+    for field in INDEX_DTYPE.names[1:]:
+        index[field] = headers[field]
+
+    return index
+
+
+def index_headers(index):
+    """
+    Headers (HEADER_DTYPE) of the records of an index.
+    """
+    headers = np.empty(len(index), dtype=HEADER_DTYPE)
+    for field in HEADER_DTYPE.names:
+        headers[field] = index[field]
+    return headers
+
+
+class SpectraWriter(object):
+    """
+    Writes the records of a spectra file as they arrive and its sidecar
+    index when closed, with only the index rows kept in memory.
+
+        with SpectraWriter(path_to_file) as writer:
+            for spectrum in spectra:
+                writer.write(spectrum.getBytes())
+    """
+    def __init__(self, path_to_file):
+        self.path_to_file = path_to_file
+        self.fd = open(path_to_file, "wb")
+        self.size = 0
+        self.rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, record):
+        row = make_index(record, [0])
+        row["offset"] = self.size
+        self.fd.write(record)
+        self.rows.append(row)
+        self.size += len(record)
+
+    def close(self):
+        """ Syncs the spectra file to the disk and writes its index. """
+        if self.fd.closed:
+            return
+        self.fd.flush()
+        fsync(self.fd.fileno())
+        self.fd.close()
+        write_index(self.path_to_file, np.concatenate(self.rows) if self.rows
+                    else np.zeros(0, dtype=INDEX_DTYPE))
+
+
+def write_index(path_to_file, index):
+    with open(index_filename(path_to_file), 'wb') as fd:
+        np.save(fd, index)
+    debug(f"Index saved to {index_filename(path_to_file)}.")
+
+
+def read_index(path_to_file):
+    """
+    Memory-mapped index of a spectra file, None if there is no sidecar or if
+    it doesn't match the spectra file.
+    """
+    if not path.exists(index_filename(path_to_file)):
+        return
+
+    try:
+        index = np.load(index_filename(path_to_file), mmap_mode='r')
+    except (ValueError, OSError) as e:
+        warning(f"Can't read {index_filename(path_to_file)} : {e}")
+        return
+
+    if index.dtype != INDEX_DTYPE:
+        warning(f"Unknown index format in {index_filename(path_to_file)}.")
+        return
+
+    size = 0 if len(index) == 0 else \
+        int(index["offset"][-1]) + int(index["total"][-1])
+
+    if size != path.getsize(path_to_file):
+        warning(f"{index_filename(path_to_file)} doesn't match "
+                f"{path_to_file}, ignored.")
+        return
+
+    return index
@@ -1,10 +1,292 @@
 
+from functools import lru_cache
+from mmap import mmap, ACCESS_READ
+from os import fstat
+from pickle import load
+from struct import unpack_from
+from sys import stdin
+
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
 
-from hypernets.reader.spectrum import Spectrum
+from hypernets.reader.spectrum import Spectrum, HEADER_DTYPE, HEADER_SIZE, \
+    CRC_SIZE
+from hypernets.reader.sidecar import read_index, index_headers
+from hypernets.reader.verify import verify_spectra
 from hypernets.reader.wavelength_to_rgba import make_color_list
 
+from logging import warning
+
+
+def index_spectra(buffer):
+    """
+    Offsets of every record of a spectra buffer, hopping from record to
+    record with the 'Total Dataset Length' field (no decoding).
+    """
+    offsets = []
+    index = 0
+    while index < len(buffer):
+        if len(buffer) - index < 2:
+            warning(f"{len(buffer) - index} trailing byte at offset {index} "
+                    "(truncated record).")
+            break
+
+        total, = unpack_from('<H', buffer, index)
+        if total < HEADER_SIZE + CRC_SIZE:
+            warning(f"Invalid record length ({total}) at offset {index}, "
+                    "stop reading.")
+            break
+
+        if index + total > len(buffer):
+            warning(f"Truncated record at offset {index} ({total} bytes, "
+                    f"{len(buffer) - index} left), stop reading.")
+            break
+
+        offsets.append(index)
+        index += total
+    return np.array(offsets, dtype=np.int64)
+
+
+def read_headers(buffer, offsets=None):
+    """
+    Headers of the records of a buffer as a structured array (HEADER_DTYPE),
+    counts are not decoded.
+    """
+    if offsets is None:
+        offsets = index_spectra(buffer)
+
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if np.any(offsets + HEADER_SIZE > len(buffer)):
+        warning(f"Offsets past the end of the buffer ({len(buffer)} bytes) "
+                "ignored.")
+        offsets = offsets[offsets + HEADER_SIZE <= len(buffer)]
+
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    index = offsets[:, None] + np.arange(HEADER_SIZE)
+    return raw[index].view(HEADER_DTYPE).reshape(-1)
+
+
+def read_counts(buffer, offsets, pixel_count):
+    """
+    Counts of the records at 'offsets' (all of 'pixel_count' pixels) as a
+    (records x pixels) uint16 array.
+    """
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    index = (offsets + HEADER_SIZE)[:, None] + np.arange(2 * pixel_count)
+    return raw[index].view('<u2').reshape(len(offsets), pixel_count)
+
+
+def index_file(filename, verify=False):
+    """
+    Content, offsets and headers of the records of a spectra file, only
+    records with a valid CRC if verify. With a sidecar index, offsets and
+    headers are read from it and the file is memory-mapped for the counts.
+    """
+    index = None if verify else read_index(filename)
+
+    with open(filename, 'rb') as fd:
+        if index is None:
+            buffer = fd.read()
+        elif len(index) == 0:
+            buffer = b""
+        else:
+            buffer = mmap(fd.fileno(), 0, access=ACCESS_READ)
+
+    if index is not None:
+        return buffer, index["offset"].astype(np.int64), index_headers(index)
+
+    if verify:
+        offsets, crc_ok, _ = verify_spectra(buffer)
+        offsets = offsets[crc_ok]
+    else:
+        offsets = index_spectra(buffer)
+
+    return buffer, offsets, read_headers(buffer, offsets)
+
+
+def iter_spectra(fileobj, chunk_size=1 << 16):
+    """
+    Generator of the Spectrum of a file object read by chunks, records are
+    yielded as soon as they are complete. Works on non-seekable inputs
+    (stdin, tar members, gzip streams...), memory is bounded to one chunk
+    plus one record.
+    """
+    pending = bytearray()
+    while chunk := fileobj.read(chunk_size):
+        pending += chunk
+
+        index = 0
+        while len(pending) - index >= 2:
+            total, = unpack_from('<H', pending, index)
+            if total < HEADER_SIZE + CRC_SIZE:
+                warning(f"Invalid record length ({total}), stop reading.")
+                return
+
+            if len(pending) - index < total:
+                break
+
+            # Copy of the record : the Spectrum must not view 'pending'
+            yield Spectrum(bytes(pending[index:index+total]))
+            index += total
+
+        del pending[:index]
+
+    if pending:
+        warning(f"{len(pending)} trailing bytes (truncated record).")
+
+
+def stream_headers(fileobj, chunk_size=1 << 16):
+    """
+    Offsets and headers (HEADER_DTYPE) of the records of a file object read
+    with iter_spectra().
+    """
+    offsets, headers = [], []
+    offset = 0
+    for spectrum in iter_spectra(fileobj, chunk_size):
+        offsets.append(offset)
+        headers.append(tuple(getattr(spectrum, field)
+                             for field in HEADER_DTYPE.names))
+        offset += spectrum.total
+
+    return np.array(offsets, dtype=np.int64), \
+        np.array(headers, dtype=HEADER_DTYPE)
+
+
+def scan_headers(filenames):
+    """
+    Header table of one or several spectra files : one row per record with
+    the file name and the offset of the record. Headers are read from the
+    sidecar index if there is one. "-" reads from stdin.
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    width = max([len(filename) for filename in filenames], default=1)
+    scan_dtype = np.dtype([("filename", f'U{width}'), ("offset", '<i8')] +
+                          HEADER_DTYPE.descr)
+
+    tables = []
+    for filename in filenames:
+        if filename == "-":
+            offsets, headers = stream_headers(stdin.buffer)
+        elif (index := read_index(filename)) is not None:
+            offsets = index["offset"].astype(np.int64)
+            headers = index_headers(index)
+        else:
+            with open(filename, 'rb') as fd:
+                if fstat(fd.fileno()).st_size == 0:
+                    warning(f"{filename} is empty.")
+                    continue
+                buffer = mmap(fd.fileno(), 0, access=ACCESS_READ)
+
+            offsets = index_spectra(buffer)
+            headers = read_headers(buffer, offsets)
+            end = int(offsets[-1]) + int(headers["total"][-1]) \
+                if len(offsets) else 0
+            if end != len(buffer):
+                warning(f"{filename} : truncated tail of {len(buffer) - end} "
+                        "bytes skipped.")
+            buffer.close()
+
+        table = np.empty(len(headers), dtype=scan_dtype)
+        table["filename"] = filename
+        table["offset"] = offsets
+        for field in HEADER_DTYPE.names:
+            table[field] = headers[field]
+        tables.append(table)
+
+    if not tables:
+        return np.empty(0, dtype=scan_dtype)
+    return np.concatenate(tables)
+
+
+def write_headers_csv(table, fd):
+    """
+    Write a table from scan_headers() as CSV, with decoded timestamp and
+    spectrum type.
+    """
+    columns = ["filename", "offset", "datetime", "radiometer", "entrance"]
+    columns += [field for field in HEADER_DTYPE.names if field != "total"]
+    fd.write(",".join(columns) + "\n")
+
+    spectrum_info = dict()
+    for row in table:
+        spec_type = int(row["spec_type"])
+        if spec_type not in spectrum_info:
+            spectrum_info[spec_type] = Spectrum.read_spectrum_info(spec_type)
+        radiometer, entrance = spectrum_info[spec_type]
+
+        timestamp = Spectrum.read_timestamp(int(row["timestamp"]))
+        values = [row["filename"], row["offset"], timestamp.isoformat(),
+                  radiometer, entrance]
+        values += [row[field] for field in HEADER_DTYPE.names
+                   if field != "total"]
+        fd.write(",".join(str(value) for value in values) + "\n")
+
+
+def load_config_dump(filename="config.dump"):
+    """
+    Serials, calibration coefficients and GPS position from a dump of
+    dump_current_config.py.
+    """
+    with open(filename, 'rb') as conf:
+        return load(conf)
+
+
+def load_calibration_coefficients(filename="config.dump"):
+    """
+    Calibration coefficients from a dump of dump_current_config.py, None if
+    they can't be read.
+    """
+    try:
+        _, cc, _ = load_config_dump(filename)
+        print(cc)
+        return cc
+
+    except Exception as e:
+        print(f"Warning : {e}")
+
+
+@lru_cache(maxsize=32)
+def wavelength_axis(coefficients, pixel_count):
+    """
+    Wavelengths of the pixels from the calibration polynomial coefficients
+    (tuple, increasing powers). Computed once per calibration set.
+    """
+    wavelengths = np.polyval(coefficients[::-1], np.arange(pixel_count))
+    wavelengths.flags.writeable = False
+    return wavelengths
+
+
+def calibrated_wavelengths(cc, radiometer, pixel_count):
+    """
+    Wavelength axis of a radiometer ('VIS' or 'SWIR'), pixel index if there
+    is no calibration for it.
+    """
+    if radiometer == 'VIS':
+        coefficients = cc.vnir_wavelength_coefficients
+    elif radiometer == 'SWIR':
+        coefficients = cc.swir_wavelength_coefs
+    else:
+        return np.arange(pixel_count)
+
+    return wavelength_axis(tuple(float(k) for k in coefficients), pixel_count)
+
+
+def linearity_correction(counts, lin_coefs):
+    """
+    Non-linearity correction of counts (any shape), as a single array
+    operation. No correction if the first coefficient is 0.
+    """
+    lin_coefs = [float(k) for k in lin_coefs]
+    if lin_coefs[0] == 0:
+        return counts
+
+    counts = np.asarray(counts, dtype=np.float64)
+    return counts / np.polyval(lin_coefs[::-1], counts)
+
 
 def show_interactive_plots(spectra):
 
@@ -23,7 +305,17 @@ def show_interactive_plots(spectra):
 
 
 class Spectra(list[Spectrum]):
-    def __init__(self, filename, figure=None, axes=None, fancy_mode=True, cc=None, spectrum=None):
+    """
+    List of the Spectrum of a file.
+
+    With lazy=True the file is memory-mapped and only the offsets of the
+    records are read up front (from the sidecar index if there is one) : a
+    Spectrum is decoded when it is accessed.
+
+    With verify=True the CRC of the records are checked and only valid
+    records are kept, resynchronising after corrupted ones.
+    """
+    def __init__(self, filename, figure=None, axes=None, fancy_mode=True, cc=None, spectrum=None, lazy=False, verify=False): # noqa
 
         if figure is not None and axes is not None and fancy_mode is True:
             self.clim, self.col = make_color_list()
@@ -35,22 +327,59 @@ class Spectra(list[Spectrum]):
         self.index = 0
         self.shown = False
 
+        # Calibration coefficients are only needed to plot
+        if self.cc is None and self.axes is not None:
+            self.cc = load_calibration_coefficients()
+            if self.cc is None:
+                self.fancy_mode = False
+
+        self.lazy = lazy and spectrum is None
+        self.buffer = None
+        self.offsets = None
+
         if spectrum is None:
-            # Open the file and create a list of Spectrum
             with open(filename, 'rb') as fd:
-                spectra_file = fd.read()
+                if self.lazy:
+                    self.buffer = mmap(fd.fileno(), 0, access=ACCESS_READ)
+                else:
+                    self.buffer = memoryview(fd.read())
+
+            if verify:
+                offsets, crc_ok, _ = verify_spectra(self.buffer)
+                self.offsets = offsets[crc_ok]
+            elif (index := read_index(filename)) is not None:
+                self.offsets = index["offset"].astype(np.int64)
+            else:
+                self.offsets = index_spectra(self.buffer)
 
-            index = 0
-            while index < len(spectra_file):
-                current_spectrum = Spectrum(spectra_file[index:])
-                self.append(current_spectrum)
-                index += current_spectrum.total
+            if not self.lazy:
+                # Records are decoded in place (no copy of the file)
+                for offset in self.offsets:
+                    self.append(Spectrum(self.buffer, int(offset)))
         else:
             self.append(Spectrum(spectrum))
         print(f"{len(self)} spectra read.")
 
         self.update()
 
+    def __len__(self):
+        if self.lazy:
+            return len(self.offsets)
+        return super().__len__()
+
+    def __getitem__(self, index):
+        if not self.lazy:
+            return super().__getitem__(index)
+        if isinstance(index, slice):
+            return [Spectrum(self.buffer, int(offset))
+                    for offset in self.offsets[index]]
+        return Spectrum(self.buffer, int(self.offsets[index]))
+
+    def __iter__(self):
+        if not self.lazy:
+            return super().__iter__()
+        return (Spectrum(self.buffer, int(offset)) for offset in self.offsets)
+
     def next_spectrum(self, event):
         self.index = (self.index + 1) % len(self)
         self.update()
@@ -67,8 +396,6 @@ class Spectra(list[Spectrum]):
             x, y = self.scale_wavelength()
 
             if self.fancy_mode:
-
-                import numpy as np
                 extent = (np.min(x), np.max(x), np.min(y), np.max(y))
                 X, _ = np.meshgrid(x, y)
 
@@ -93,34 +420,14 @@ class Spectra(list[Spectrum]):
             self.figure.canvas.draw()
 
     def scale_wavelength(self):
-
-        def apply(x, coefs):
-            return sum([k * (x**p) for p, k in enumerate(coefs)])
-
-        if self.cc is None:
-            try:
-                from pickle import load
-                with open("config.dump", 'rb') as conf:
-                    _, self.cc, _ = load(conf)
-                    print(self.cc)
-
-            except Exception as e:
-                print(f"Warning : {e}")
-                self.fancy_mode = False
-
-        x = range(len(self.current_spectrum.counts))
         y = self.current_spectrum.counts
-
-        s_typ, _ = Spectrum.read_spectrum_info(self.current_spectrum.spec_type)
+        x = np.arange(len(y))
 
         if self.cc is not None:
+            s_typ, _ = Spectrum.read_spectrum_info(self.current_spectrum.spec_type) # noqa
+            x = calibrated_wavelengths(self.cc, s_typ, len(y))
             if s_typ == 'VIS':
-                x = [apply(i, list(self.cc.vnir_wavelength_coefficients)) for i in x] # noqa
-                if self.cc.vnir_lin_coefs[0] != 0:
-                    y = [i/apply(i, list(self.cc.vnir_lin_coefs)) for i in y]
-
-            elif s_typ == 'SWIR':
-                x = [apply(i, list(self.cc.swir_wavelength_coefs)) for i in x]
-                # y = [i/apply(i, vnir_lin) for i in y] ?
+                y = linearity_correction(y, self.cc.vnir_lin_coefs)
+            # elif s_typ == 'SWIR': ?
 
         return x, y
@@ -1,62 +1,90 @@
 #!/usr/bin/python
 
 from datetime import datetime, timezone
-from struct import unpack, calcsize
 
-from hypernets.hypstar.libhypstar.python.data_structs.spectrum import \
-    Spectrum as HySpectrum
+import numpy as np
+
+from logging import info, getLogger, INFO
+
+
+# Packed little-endian record header, as sent by the instrument
+HEADER_DTYPE = np.dtype([("total", '<u2'),
+                         ("spec_type", 'u1'),
+                         ("timestamp", '<u8'),
+                         ("exposure_time", '<u2'),
+                         ("temperature", '<f4'),
+                         ("pixel_count", '<u2'),
+                         ("mean_X", '<i2'),
+                         ("std_X", '<i2'),
+                         ("mean_Y", '<i2'),
+                         ("std_Y", '<i2'),
+                         ("mean_Z", '<i2'),
+                         ("std_Z", '<i2')])
+
+HEADER_SIZE = HEADER_DTYPE.itemsize
+CRC_SIZE = 4
 
-from logging import info
 
 class Spectrum(object):
-    def __init__(self, data):
-        self.headerDef = [("Total Dataset Length", 'H', None),
-                          ("Spectrum Type Information", 'B', self.read_spectrum_info),  # noqa
-                          ("Timestamp", 'Q', self.read_timestamp),
-                          ("Exposure Time", 'H', None),
-                          ("Temperature", 'f', None),
-                          ("Pixel Count", 'H', None),
-                          ("mean X", 'h', None),
-                          ("std X", 'h', None),
-                          ("mean Y", 'h', None),
-                          ("std Y", 'h', None),
-                          ("mean Z", 'h', None),
-                          ("std Z", 'h', None)]
-
-        self.str = ""
-
-        # concat all formats together
-        headerFormat = '<' + "".join(fmt for _, fmt, _ in self.headerDef)
-
-        # compute size of the whole header and unpack it
-        headerSize = calcsize(headerFormat)
-        header = unpack(headerFormat, data[:headerSize])
-
-        for definition, value in zip(self.headerDef, header):
-            post_process = definition[2]
-            if post_process is not None:
-                value = post_process(value)
-            self.str += f"{definition[0]} : {value}\n"
+    """
+    One record of a spectra file : header fields as attributes (same names
+    as in HEADER_DTYPE) and counts as a uint16 view on the source buffer.
+    """
+    __slots__ = HEADER_DTYPE.names + ("counts", "crc")
+
+    # (description, attribute, post-processing)
+    headerDef = (("Total Dataset Length", "total", None),
+                 ("Spectrum Type Information", "spec_type", "read_spectrum_info"), # noqa
+                 ("Timestamp", "timestamp", "read_timestamp"),
+                 ("Exposure Time", "exposure_time", None),
+                 ("Temperature", "temperature", None),
+                 ("Pixel Count", "pixel_count", None),
+                 ("mean X", "mean_X", None),
+                 ("std X", "std_X", None),
+                 ("mean Y", "mean_Y", None),
+                 ("std Y", "std_Y", None),
+                 ("mean Z", "mean_Z", None),
+                 ("std Z", "std_Z", None))
 
-        info(f"{self}" + "-" * 80)
+    def __init__(self, data, offset=0):
+        """
+        Decode the record starting at 'offset' of 'data' (bytes, memoryview,
+        mmap...) without copying it : counts are a read-only uint16 view.
+        """
+        header = np.frombuffer(data, dtype=HEADER_DTYPE, count=1,
+                               offset=offset)[0].item()
 
         # Header expansion
         self.total, self.spec_type, self.timestamp, self.exposure_time,\
             self.temperature, self.pixel_count, self.mean_X, self.std_X,\
             self.mean_Y, self.std_Y, self.mean_Z, self.std_Z = header
 
-        # Read raw counts
-        self.counts = unpack('<' + self.pixel_count * 'H',
-                             data[headerSize:headerSize+self.pixel_count*2])
+        # Raw counts (view on the source buffer)
+        offset += HEADER_SIZE
+        self.counts = np.frombuffer(data, dtype='<u2',
+                                    count=self.pixel_count, offset=offset)
 
-        self.crc = unpack('<I', data[headerSize+self.pixel_count*2:
-                                     headerSize+self.pixel_count*2+4])
+        offset += self.pixel_count * 2
+        self.crc = np.frombuffer(data, dtype='<u4', count=1,
+                                 offset=offset)[0].item()
+
+        # Formatting the header is expensive, only do it if it is logged
+        if getLogger().isEnabledFor(INFO):
+            info(f"{self}" + "-" * 80)
 
     def __str__(self):
-        return self.str
+        spectrum_str = ""
+        for description, attribute, post_process in self.headerDef:
+            value = getattr(self, attribute)
+            if post_process is not None:
+                value = getattr(self, post_process)(value)
+            spectrum_str += f"{description} : {value}\n"
+        return spectrum_str
 
     @staticmethod
     def read_spectrum_info(spec_type: int):
+        from hypernets.hypstar.libhypstar.python.data_structs.spectrum import \
+            Spectrum as HySpectrum
         spec_type = HySpectrum.SpectrumHeader.SpectrumType.parse_raw(spec_type)
         return spec_type.radiometer.name, spec_type.optics.name
 
@@ -0,0 +1,169 @@
+"""
+CRC verification of spectra files, with resynchronisation on the next
+plausible header after a corrupted record.
+
+The instrument computes the CRC with the STM32 hardware unit : CRC-32
+(polynomial 0x04C11DB7, init 0xFFFFFFFF, no reflection, no final xor) over
+the little-endian 32-bit words of the record, the last word being padded
+with zeros. It is computed here with zlib on bit-reflected data.
+"""
+
+from struct import unpack_from
+from zlib import crc32
+
+import numpy as np
+
+from hypernets.abstract.name_convention import RADIOMETERS, RADIOMETER_MASK
+from hypernets.reader.spectrum import HEADER_DTYPE, HEADER_SIZE, CRC_SIZE
+
+from logging import debug, warning
+
+
+MAX_PIXEL_COUNT = 4096
+PIXEL_COUNT_OFFSET = HEADER_DTYPE.fields["pixel_count"][1]
+
+# Records per bulk CRC computation (bounds the memory of a file check)
+CRC_CHUNK = 256
+
+# Bit reflection of a byte
+REFLECT = np.array([int(f"{i:08b}"[::-1], 2) for i in range(256)],
+                   dtype=np.uint8)
+
+
+def is_plausible_header(total, spec_type, pixel_count):
+    """
+    Header check on the length, pixel count and type (one radiometer, one
+    entrance) fields. Works on scalars and arrays.
+    """
+    radiometer = spec_type & RADIOMETER_MASK
+    return ((total == HEADER_SIZE + 2 * pixel_count + CRC_SIZE) &
+            (pixel_count > 0) & (pixel_count <= MAX_PIXEL_COUNT) &
+            ((radiometer == RADIOMETERS["vnir"]) |
+             (radiometer == RADIOMETERS["swir"])) &
+            ((spec_type & 0x18) != 0x18))
+
+
+def plausible_length(buffer, index):
+    """
+    Length of the record at 'index' if its header is plausible and the
+    record fits in the buffer, None otherwise.
+    """
+    if index + HEADER_SIZE > len(buffer):
+        return
+
+    total, spec_type = unpack_from('<HB', buffer, index)
+    pixel_count, = unpack_from('<H', buffer, index + PIXEL_COUNT_OFFSET)
+
+    if not is_plausible_header(total, spec_type, pixel_count):
+        return
+
+    if index + total > len(buffer):
+        return
+
+    return total
+
+
+def find_next_header(buffer, start, window=1 << 16):
+    """
+    Offset of the first plausible header after 'start', None if there is
+    none. The buffer is scanned by windows so that memory stays bounded.
+    """
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+
+    while start + HEADER_SIZE <= len(raw):
+        chunk = raw[start:start + window + HEADER_SIZE].astype(np.int32)
+        n = len(chunk) - HEADER_SIZE + 1
+
+        total = chunk[:n] | chunk[1:n+1] << 8
+        spec_type = chunk[2:n+2]
+        pixel_count = chunk[PIXEL_COUNT_OFFSET:n+PIXEL_COUNT_OFFSET] |\
+            chunk[PIXEL_COUNT_OFFSET+1:n+PIXEL_COUNT_OFFSET+1] << 8
+
+        candidates = np.flatnonzero(is_plausible_header(total, spec_type,
+                                                        pixel_count))
+        if len(candidates):
+            return start + int(candidates[0])
+
+        start += n
+
+
+def records_crc(buffer, offsets, totals):
+    """
+    CRC of the records at 'offsets' computed from their content, and the CRC
+    stored at their end.
+    """
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    totals = np.asarray(totals, dtype=np.int64)
+
+    computed = np.empty(len(offsets), dtype=np.uint32)
+    stored_index = (offsets + totals - CRC_SIZE)[:, None] + np.arange(CRC_SIZE)
+    stored = raw[stored_index].copy().view('<u4').reshape(-1)
+
+    for total in np.unique(totals):
+        length = int(total) - CRC_SIZE
+        words = -(-length // 4)
+        group = np.flatnonzero(totals == total)
+
+        for chunk in np.array_split(group, -(-len(group) // CRC_CHUNK)):
+            data = np.zeros((len(chunk), words * 4), dtype=np.uint8)
+            data[:, :length] = raw[offsets[chunk, None] + np.arange(length)]
+
+            # STM32 words (little-endian) as a bit-reflected byte stream
+            data = REFLECT[data.reshape(len(chunk), words, 4)[:, :, ::-1]]
+            data = data.reshape(len(chunk), -1)
+            computed[chunk] = [crc32(row) for row in data]
+
+    # Undo the final xor of zlib and reflect the 32-bit results
+    computed = REFLECT[(computed ^ 0xFFFFFFFF).astype('<u4').view(np.uint8)
+                       .reshape(-1, 4)[:, ::-1]]
+    computed = np.ascontiguousarray(computed).view('<u4').reshape(-1)
+
+    return computed, stored
+
+
+def verify_spectra(buffer):
+    """
+    Verifying index of a spectra buffer. Hop from record to record with the
+    length field, resynchronise on the next plausible header whose CRC is
+    valid after an unreadable record, then check the CRC of all the records
+    in bulk.
+
+    Returns the offsets of the records, a boolean array of valid CRC and the
+    number of skipped (unreadable) regions.
+    """
+    offsets, totals = [], []
+    skipped = 0
+    index = 0
+
+    while index < len(buffer):
+        total = plausible_length(buffer, index)
+        if total is not None:
+            offsets.append(index)
+            totals.append(total)
+            index += total
+            continue
+
+        skipped += 1
+        debug(f"Unreadable record at offset {index}, resynchronising...")
+
+        start = index + 1
+        index = len(buffer)
+        while (candidate := find_next_header(buffer, start)) is not None:
+            total = plausible_length(buffer, candidate)
+            if total is not None:
+                computed, stored = records_crc(buffer, [candidate], [total])
+                if computed[0] == stored[0]:
+                    index = candidate
+                    break
+            start = candidate + 1
+
+    offsets = np.array(offsets, dtype=np.int64)
+    computed, stored = records_crc(buffer, offsets, totals)
+    crc_ok = computed == stored
+
+    if skipped or not crc_ok.all():
+        warning(f"{crc_ok.sum()} good records, {(~crc_ok).sum()} bad CRC, "
+                f"{skipped} unreadable regions.")
+
+    return offsets, crc_ok, skipped
@@ -0,0 +1,59 @@
+"""
+Repair of a datacube after an interrupted append.
+"""
+
+import numpy as np
+
+from hypernets.processing.datacube import DataCube, INDEX_DTYPE
+
+
+PIXEL_COUNT = 4
+
+
+def make_rows(sequence, count):
+    rows = np.zeros(count, dtype=INDEX_DTYPE)
+    rows["sequence"] = sequence
+    rows["line"] = np.arange(count)
+    return rows
+
+
+def make_cube(directory):
+    cube = DataCube(directory)
+    cube.create(np.arange(PIXEL_COUNT), "counts/ms", "vnir_rad")
+    cube.append("SEQ1", make_rows("SEQ1", 2), np.ones((2, PIXEL_COUNT)))
+    cube.append("SEQ2", make_rows("SEQ2", 3), 2 * np.ones((3, PIXEL_COUNT)))
+    return cube
+
+
+def test_reopen(tmp_path):
+    make_cube(str(tmp_path))
+    cube = DataCube(str(tmp_path))
+    assert len(cube) == 5
+    assert cube.processed == {"SEQ1", "SEQ2"}
+    assert list(cube.index["sequence"]) == ["SEQ1"] * 2 + ["SEQ2"] * 3
+
+
+def test_repair_partial_row(tmp_path):
+    make_cube(str(tmp_path))
+    with open(tmp_path / "spectra.f4", "ab") as fd:
+        fd.write(bytes(6))
+    with open(tmp_path / "index.bin", "ab") as fd:
+        fd.write(make_rows("SEQ3", 1).tobytes())
+
+    cube = DataCube(str(tmp_path))
+    assert len(cube) == 5
+    assert (tmp_path / "spectra.f4").stat().st_size == 5 * 4 * PIXEL_COUNT
+
+
+def test_repair_unrecorded_sequence(tmp_path):
+    make_cube(str(tmp_path))
+    # rows of SEQ3 written, but not its name in sequences.txt
+    with open(tmp_path / "spectra.f4", "ab") as fd:
+        fd.write(np.zeros((2, PIXEL_COUNT), dtype=np.float32).tobytes())
+    with open(tmp_path / "index.bin", "ab") as fd:
+        fd.write(make_rows("SEQ3", 2).tobytes())
+
+    cube = DataCube(str(tmp_path))
+    assert len(cube) == 5
+    assert np.all(cube.spectra[2:] == 2)
+    assert "SEQ3" not in cube.processed
@@ -0,0 +1,38 @@
+"""
+Decoding of the names of the files of a sequence.
+"""
+
+from hypernets.abstract.name_convention import decode_names, ENTRANCES, \
+    RADIOMETERS
+
+
+def test_decode_spectra_name():
+    table = decode_names(["SEQ20210609T093031/RADIOMETER/"
+                          "01_015_0090_2_0180_128_16_0064_03_0000.spe"])
+    row = table[0]
+    assert row["valid"]
+    assert (row["iter_scheduler"], row["line"], row["pan"], row["reference"],
+            row["tilt"]) == (1, 15, 90, 2, 180)
+    assert row["radiometer"] == RADIOMETERS["vnir"]
+    assert row["entrance"] == ENTRANCES["rad"]
+    assert (row["it"], row["count"], row["total_time"]) == (64, 3, 0)
+
+
+def test_decode_block_and_picture():
+    table = decode_names(["01_015_0090_2_0180", "02_003_0270_1_0040.jpg"])
+    assert table["valid"].all()
+    assert list(table["line"]) == [15, 3]
+    assert table["radiometer"][0] == -1
+    assert table["radiometer"][1] == 0x00
+    assert table["entrance"][1] == ENTRANCES["pic"]
+
+
+def test_invalid_names():
+    table = decode_names(["metadata.txt", "01_015_0090_2_0180.spe",
+                          "01_0x5_0090_2_0180", "01_015_0090_2_0180"])
+    assert list(table["valid"]) == [False, False, False, True]
+    assert table["line"][0] == -1
+
+
+def test_empty():
+    assert len(decode_names([])) == 0
@@ -0,0 +1,48 @@
+"""
+Ordering of the pan-tilt positions of a protocol block.
+"""
+
+from itertools import permutations
+
+from hypernets.geometry.path_planning import plan_path
+
+
+def path_cost(costs, order, start_costs=None):
+    cost = sum(costs[a][b] for a, b in zip(order[:-1], order[1:]))
+    if start_costs:
+        cost += start_costs[order[0]]
+    return cost
+
+
+def line_costs(positions):
+    return [[abs(a - b) for b in positions] for a in positions]
+
+
+def test_small_blocks():
+    assert plan_path([]) == []
+    assert plan_path([[0.]]) == [0]
+
+
+def test_positions_on_a_line():
+    positions = [0, 30, 10, 40, 20]
+    order = plan_path(line_costs(positions))
+    assert sorted(order) == list(range(len(positions)))
+    assert path_cost(line_costs(positions), order) == 40
+
+
+def test_start_costs():
+    positions = [0, 30, 10, 40, 20]
+    costs = line_costs(positions)
+    start_costs = [abs(p - 40) for p in positions]
+    order = plan_path(costs, start_costs)
+    assert order[0] == 3
+    assert path_cost(costs, order, start_costs) == 40
+
+
+def test_not_worse_than_best_order():
+    positions = [(0, 0), (50, 10), (5, 80), (60, 90), (30, 40), (10, 15)]
+    costs = [[max(abs(a[0] - b[0]), abs(a[1] - b[1])) for b in positions]
+             for a in positions]
+    best = min(path_cost(costs, list(order))
+               for order in permutations(range(len(positions))))
+    assert path_cost(costs, plan_path(costs)) <= best + 1e-9
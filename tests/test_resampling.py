@@ -0,0 +1,22 @@
+"""
+Pairing of the VNIR and SWIR series before stitching.
+"""
+
+from hypernets.processing.resampling import pair_series
+
+
+def test_pair_same_lines():
+    vnir, swir = pair_series([3, 5, 7, 9], [9, 5, 2])
+    assert list(vnir) == [1, 3]
+    assert list(swir) == [1, 0]
+
+
+def test_lines_with_several_series_unpaired():
+    vnir, swir = pair_series([3, 3, 5], [3, 5])
+    assert list(vnir) == [2]
+    assert list(swir) == [1]
+
+
+def test_nothing_paired():
+    vnir, swir = pair_series([1, 2], [3])
+    assert len(vnir) == len(swir) == 0
@@ -0,0 +1,70 @@
+"""
+Sidecar index of spectra files.
+"""
+
+from struct import pack
+
+import numpy as np
+
+from hypernets.reader.sidecar import make_index, write_index, read_index, \
+    index_filename
+from hypernets.reader.spectra import index_spectra, read_headers, \
+    scan_headers
+from hypernets.reader.spectrum import HEADER_DTYPE, HEADER_SIZE, CRC_SIZE
+
+
+PIXEL_COUNT = 8
+
+
+def make_record(timestamp, spec_type=0x90):
+    total = HEADER_SIZE + 2 * PIXEL_COUNT + CRC_SIZE
+    header = pack('<HBQHfHhhhhhh', total, spec_type, timestamp, 64, 25.,
+                  PIXEL_COUNT, 1, 2, 3, 4, 5, 6)
+    return header + bytes(2 * PIXEL_COUNT) + bytes(CRC_SIZE)
+
+
+RECORDS = b"".join(make_record(1000 * i, spec_type)
+                   for i, spec_type in enumerate([0x90, 0x88, 0x50]))
+
+
+def write_spectra(tmp_path, buffer):
+    filename = str(tmp_path / "01_001_0000_1_0000.spe")
+    with open(filename, 'wb') as fd:
+        fd.write(buffer)
+    write_index(filename, make_index(buffer, index_spectra(buffer)))
+    return filename
+
+
+def test_round_trip(tmp_path):
+    filename = write_spectra(tmp_path, RECORDS)
+    index = read_index(filename)
+    offsets = index_spectra(RECORDS)
+    assert list(index["offset"]) == list(offsets)
+
+    headers = read_headers(RECORDS, offsets)
+    for field in HEADER_DTYPE.names:
+        assert list(index[field]) == list(headers[field])
+
+
+def test_size_mismatch(tmp_path):
+    filename = write_spectra(tmp_path, RECORDS)
+    with open(filename, 'ab') as fd:
+        fd.write(make_record(3000))
+    assert read_index(filename) is None
+
+
+def test_no_sidecar(tmp_path):
+    filename = write_spectra(tmp_path, RECORDS)
+    (tmp_path / index_filename("01_001_0000_1_0000.spe")).unlink()
+    assert read_index(filename) is None
+
+
+def test_scan_headers_from_sidecar(tmp_path):
+    filename = write_spectra(tmp_path, RECORDS)
+    expected = scan_headers([filename])
+
+    # Headers come from the index, not from the (overwritten) records
+    with open(filename, 'r+b') as fd:
+        fd.write(bytes(len(RECORDS)))
+    table = scan_headers([filename])
+    assert np.array_equal(table, expected)
@@ -0,0 +1,54 @@
+"""
+Indexing of spectra files with a truncated tail (interrupted write).
+"""
+
+from struct import pack
+
+import pytest
+
+from hypernets.reader.spectra import index_spectra, read_headers, \
+    scan_headers
+from hypernets.reader.spectrum import HEADER_SIZE, CRC_SIZE
+
+
+PIXEL_COUNT = 8
+
+
+def make_record(timestamp, spec_type=0x90, exposure_time=64):
+    total = HEADER_SIZE + 2 * PIXEL_COUNT + CRC_SIZE
+    header = pack('<HBQHfHhhhhhh', total, spec_type, timestamp, exposure_time,
+                  25., PIXEL_COUNT, 0, 0, 0, 0, 0, 0)
+    return header + bytes(2 * PIXEL_COUNT) + bytes(CRC_SIZE)
+
+
+RECORDS = b"".join(make_record(1000 * i) for i in range(3))
+RECORD_SIZE = len(RECORDS) // 3
+
+
+@pytest.mark.parametrize("tail", [0, 1, 2, HEADER_SIZE, RECORD_SIZE - 1])
+def test_index_truncated_tail(tail):
+    buffer = RECORDS[:2 * RECORD_SIZE + tail]
+    offsets = index_spectra(buffer)
+    assert list(offsets) == [0, RECORD_SIZE]
+
+
+def test_scan_truncated_file(tmp_path):
+    filename = tmp_path / "01_001_0000_1_0000.spe"
+    filename.write_bytes(RECORDS[:-1])
+    headers = scan_headers([str(filename)])
+    assert len(headers) == 2
+    assert list(headers["timestamp"]) == [0, 1000]
+
+
+def test_scan_goes_on_after_truncated_file(tmp_path):
+    truncated = tmp_path / "01_001_0000_1_0000.spe"
+    truncated.write_bytes(RECORDS[:HEADER_SIZE])
+    complete = tmp_path / "01_002_0000_1_0000.spe"
+    complete.write_bytes(RECORDS)
+    headers = scan_headers([str(truncated), str(complete)])
+    assert list(headers["filename"]) == [str(complete)] * 3
+
+
+def test_read_headers_past_the_end():
+    headers = read_headers(RECORDS, [0, RECORD_SIZE, len(RECORDS) - 2])
+    assert list(headers["timestamp"]) == [0, 1000]
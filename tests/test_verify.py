@@ -0,0 +1,73 @@
+"""
+CRC check and resynchronisation of corrupted spectra files.
+"""
+
+from struct import pack
+
+import numpy as np
+
+from hypernets.reader.spectrum import HEADER_SIZE, CRC_SIZE
+from hypernets.reader.verify import records_crc, verify_spectra
+
+
+PIXEL_COUNT = 8
+
+
+def stm32_crc(data):
+    """ Bitwise STM32 CRC-32 of data, zero-padded to 32-bit words. """
+    data = data + bytes(-len(data) % 4)
+    crc = 0xFFFFFFFF
+    for k in range(0, len(data), 4):
+        crc ^= int.from_bytes(data[k:k+4], "little")
+        for _ in range(32):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def make_record(timestamp, spec_type=0x90):
+    total = HEADER_SIZE + 2 * PIXEL_COUNT + CRC_SIZE
+    header = pack('<HBQHfHhhhhhh', total, spec_type, timestamp, 64, 25.,
+                  PIXEL_COUNT, 0, 0, 0, 0, 0, 0)
+    record = header + pack(f'<{PIXEL_COUNT}H', *range(1000, 1000 + 8 *
+                                                      PIXEL_COUNT, 8))
+    return record + pack('<I', stm32_crc(record))
+
+
+RECORDS = [make_record(1000 * i) for i in range(3)]
+RECORD_SIZE = len(RECORDS[0])
+
+
+def test_records_crc():
+    buffer = b"".join(RECORDS)
+    offsets = np.arange(3) * RECORD_SIZE
+    computed, stored = records_crc(buffer, offsets, [RECORD_SIZE] * 3)
+    assert list(computed) == list(stored)
+    assert int(computed[1]) == stm32_crc(RECORDS[1][:-CRC_SIZE])
+
+
+def test_verify_good_file():
+    offsets, crc_ok, skipped = verify_spectra(b"".join(RECORDS))
+    assert list(offsets) == [0, RECORD_SIZE, 2 * RECORD_SIZE]
+    assert crc_ok.all()
+    assert skipped == 0
+
+
+def test_verify_bad_crc():
+    corrupted = bytearray(RECORDS[1])
+    corrupted[HEADER_SIZE + 3] ^= 0xFF
+    buffer = RECORDS[0] + bytes(corrupted) + RECORDS[2]
+    offsets, crc_ok, skipped = verify_spectra(buffer)
+    assert len(offsets) == 3
+    assert list(crc_ok) == [True, False, True]
+    assert skipped == 0
+
+
+def test_verify_resynchronises():
+    garbage = b"\x00\x01garbage"
+    buffer = RECORDS[0] + garbage + RECORDS[1] + RECORDS[2]
+    offsets, crc_ok, skipped = verify_spectra(buffer)
+    start = RECORD_SIZE + len(garbage)
+    assert list(offsets) == [0, start, start + RECORD_SIZE]
+    assert crc_ok.all()
+    assert skipped == 1